@@ -0,0 +1,51 @@
+import os
+import json
+import argparse
+
+import scripts.utils as u
+from scripts.benchmark import run_benchmarks
+from scripts.synthetic_catalog import generate_synthetic_catalog
+
+# Get the directory path of the script
+script_dir_path = os.path.dirname(os.path.abspath(__file__))
+
+# Get paths
+benchmark_dir_path = os.path.join(script_dir_path, "benchmark")
+synthetic_catalog_dir_path = os.path.join(benchmark_dir_path, "catalog")
+assets_dir_path = os.path.join(script_dir_path, "assets")
+config_template_file_path = os.path.join(script_dir_path, "config_template.yaml")
+
+# The runs are done in new processes, which import this file again, so only the main process runs the benchmark
+if __name__ == "__main__":
+    # Parse the command line arguments
+    parser = argparse.ArgumentParser(description="Measure how long generating the headers takes, on a synthetic catalog of the given size.")
+    parser.add_argument("--sets", type=int, default=1000, help="how many sets the synthetic catalog has (default: 1000)")
+    parser.add_argument("--sets-per-serie", type=int, default=25, help="how many sets each serie of the synthetic catalog has (default: 25)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic catalog, so the same catalog can be generated again (default: 0)")
+    parser.add_argument("--workers", type=int, default=1, help="how many processes render the PDF (default: 1)")
+    parser.add_argument("--output", help="write the results to this JSON file, instead of printing them")
+    args = parser.parse_args()
+
+    # Generate the synthetic catalog, next to the real one, unless it already exists with the same parameters
+    u.log(f"Generating a synthetic catalog of {args.sets} sets in {synthetic_catalog_dir_path}")
+    catalog_file_path = generate_synthetic_catalog(synthetic_catalog_dir_path, args.sets, args.sets_per_serie, args.seed)
+
+    # Start from the default config, so that results don't depend on the local config.yaml
+    # Its assets cache is kept, so the warm runs reuse the images processed by the cold ones
+    config = u.parse_yaml(config_template_file_path)
+    config["workers"] = args.workers
+    config["incremental"] = False
+
+    results = run_benchmarks(benchmark_dir_path, catalog_file_path, assets_dir_path, config, {
+        "sets": args.sets,
+        "sets_per_serie": args.sets_per_serie,
+        "seed": args.seed
+    })
+
+    results_json = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(results_json)
+        u.log(f"Results written to {args.output}")
+    else:
+        print(results_json)
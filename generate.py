@@ -1,9 +1,22 @@
 import os
 import shutil
+import pstats
+import cProfile
+import argparse
 
 from scripts.generators.page_generator import *
 from scripts.generators.card_generator import *
-from scripts.generator_data import GeneratorData
+from scripts.generators.generator import iter_pages
+from scripts.generator_data import GeneratorData, REGION_FILENAMES, COVER_FILENAME_PREFIX, SYMBOL_FILENAME_PREFIX
+from scripts.asset_cache import AssetCache
+from scripts.asset_manifest import AssetManifest, print_preflight_report
+from scripts.set_filter import SetFilter, FilterError
+from scripts.catalog import StreamedCatalog, CatalogError, load_catalog, get_snapshot_dir_path
+from scripts.batch import load_batch_jobs, run_batch
+from scripts.watcher import watch
+from scripts.shards import parse_shard, generate_shard, merge_shards
+from scripts.render_server import serve, DEFAULT_SERVER_HOST, DEFAULT_SERVER_PORT, DEFAULT_SERVER_CACHE_MAX_SIZE_MB
+import scripts.timing as timing
 
 # Links:
 # https://bulbapedia.bulbagarden.net/wiki/List_of_Pok%C3%A9mon_Trading_Card_Game_expansions
@@ -29,45 +42,207 @@ catalog_assets_dir_path = os.path.join(catalog_dir_path, "assets")
 fonts_dir_path = os.path.join(assets_dir_path, "fonts")
 config_file_path = os.path.join(script_dir_path, "config.yaml")
 config_template_file_path = os.path.join(script_dir_path, "config_template.yaml")
+cache_dir_path = os.path.join(script_dir_path, "cache")
+asset_cache_dir_path = os.path.join(cache_dir_path, "assets")
+font_cache_dir_path = os.path.join(cache_dir_path, "fonts")
+asset_manifest_file_path = os.path.join(cache_dir_path, "asset_manifest.json")
+shard_dir_path = os.path.join(script_dir_path, "shards")
+cover_filename_prefix = COVER_FILENAME_PREFIX
+symbol_filename_prefix = SYMBOL_FILENAME_PREFIX
 
-# Initialise the utils module
-u.init(fonts_dir_path, frame_imgs_dir_path)
-
-# Parse the catalog data from the catalog JSON file
-catalog = u.parse_json(catalog_file_path)
-
-# Parse the config.yaml file
-if not os.path.exists(config_file_path):
-    u.log(f"Generating config file at {config_file_path}")
-    shutil.copy(config_template_file_path, config_file_path)
-config = u.parse_yaml(config_file_path)
-
-# Set up the data object for the generator
-generator_data = GeneratorData(
-    catalog = catalog,
-    config = config,
-    output_file_path = output_file_path,
-    catalog_sets_dir_path = catalog_assets_dir_path,
-    imgs_dir_path=imgs_dir_path,
-    region_filenames = {
-        # "all": "jpn-eng.jpg",
-        "all": "eng-jpn.jpg",
-        "eng": "eng.png",
-        "jpn": "jpn.jpg"
-    },
-    cover_filename_prefix = "cover.",
-    symbol_filename_prefix = "symbol"
-)
-
-# Choose the correct generator
-headers_type = config["headers_type"]
-if headers_type == "cards":
-    generator = CardGenerator()
-elif headers_type == "pages":
-    generator = PageGenerator()
-else:
-    u.log(f"Uknown headers_type value \"{headers_type}\". Aborting.")
-    exit(1)
-
-# Generate the PDF
-generator.generate(generator_data)
+# Worker processes may import this file again (e.g. when spawned), so only the main process generates the PDF
+if __name__ == "__main__":
+    # Parse the command line arguments
+    parser = argparse.ArgumentParser(description="Generate headers for Pokémon TCG sets to insert in binder sleeves.")
+    parser.add_argument("--cache-info", action="store_true", help="print the size of the processed assets cache and exit")
+    parser.add_argument("--clear-cache", action="store_true", help="delete every processed asset in the cache and exit")
+    parser.add_argument("--build-manifest", action="store_true", help="scan every set folder in the catalog assets and rebuild the assets manifest, then exit")
+    parser.add_argument("--preflight", action="store_true", help="list the included sets with a missing cover or symbol, without rendering anything, then exit")
+    parser.add_argument("--plan-only", action="store_true", help="plan the layout of every header and print the page map, without rendering anything, then exit")
+    parser.add_argument("--timings", action="store_true", help="time each stage of the generation and print a summary table at the end")
+    parser.add_argument("--trace", metavar="FILE", help="also write the timed stages to FILE, as JSON in the Chrome trace format (viewable in chrome://tracing or Perfetto)")
+    parser.add_argument("--profile", metavar="FILE", help="run the generation under cProfile and dump the stats to FILE (worker processes aren't profiled)")
+    parser.add_argument("--batch", metavar="FILE", help="generate every job listed in the batch FILE (see batch_template.yaml) in one go, instead of a single headers.pdf")
+    parser.add_argument("--batch-workers", type=int, default=1, help="how many processes the jobs of a batch are spread across (default: 1)")
+    parser.add_argument("--serve", action="store_true", help="keep running as a local HTTP server, rendering a PDF for the config values POSTed as JSON to /render")
+    parser.add_argument("--host", default=DEFAULT_SERVER_HOST, help=f"the address the server listens on (default: {DEFAULT_SERVER_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_SERVER_PORT, help=f"the port the server listens on (default: {DEFAULT_SERVER_PORT})")
+    parser.add_argument("--shard", metavar="I/N", type=parse_shard, help="only render the I-th of N slices of the pages (e.g. 2/4), to a partial PDF and a manifest in the shards folder, to merge with --merge-shards")
+    parser.add_argument("--merge-shards", action="store_true", help="check that the shards folder holds every shard of the same PDF, concatenate them in page order into headers.pdf, then exit")
+    parser.add_argument("--shard-dir", metavar="DIR", default=shard_dir_path, help=f"the folder the shards are written to and merged from (default: {shard_dir_path})")
+    parser.add_argument("--preview", metavar="DIR", help="draw every page (and every header, if preview_headers is true) to a low resolution PNG or WebP image in DIR, instead of the PDF")
+    parser.add_argument("--watch", action="store_true", help="keep running, and generate the PDF again whenever the catalog, its assets, the images or config.yaml change, only rendering the pages that changed")
+    args = parser.parse_args()
+
+    if args.timings or args.trace:
+        timing.enable()
+
+    profiler = None
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    # Initialise the utils module
+    u.init(fonts_dir_path, frame_imgs_dir_path, font_cache_dir_path)
+
+    if args.merge_shards:
+        merge_shards(args.shard_dir, output_file_path)
+        exit(0)
+
+    # Parse the config.yaml file
+    if not os.path.exists(config_file_path):
+        u.log(f"Generating config file at {config_file_path}")
+        shutil.copy(config_template_file_path, config_file_path)
+    config = u.parse_yaml(config_file_path)
+    u.set_font_selection(config.get("font_selection", u.FONT_SELECTION_RANGES))
+    u.set_jpeg_quality(config.get("jpeg_quality", u.DEFAULT_JPEG_QUALITY))
+
+    # Set up the processed assets cache
+    asset_cache_max_size_mb = config.get("asset_cache_max_size_mb", 0)
+    asset_cache = AssetCache(asset_cache_dir_path, asset_cache_max_size_mb)
+    if args.cache_info:
+        asset_cache_entries = asset_cache.get_entries()
+        asset_cache_size_mb = sum([size for _, size, _ in asset_cache_entries]) / (1024*1024)
+        u.log(f"Assets cache at {asset_cache_dir_path}")
+        u.log(f"{len(asset_cache_entries)} processed images, {asset_cache_size_mb:.1f} MB used of {asset_cache_max_size_mb} MB", 1)
+        exit(0)
+    if args.clear_cache:
+        cleared = asset_cache.clear()
+        u.log(f"Deleted {cleared} processed images from the assets cache")
+        exit(0)
+    if asset_cache_max_size_mb > 0:
+        u.set_asset_cache(asset_cache)
+
+    # Compile the filters of the config, whose sets are selected below (or as they're read, while streaming)
+    try:
+        set_filter = SetFilter(config["filters"])
+    except FilterError as error:
+        u.log(f"Invalid filter {error}. Aborting.")
+        exit(1)
+
+    is_streaming = config.get("streaming_chunk_pages", 0) > 0 and not args.batch and not args.serve and not args.watch and not args.shard
+    if is_streaming:
+        # Read the catalog a serie at a time, while generating
+        catalog = StreamedCatalog(catalog_file_path, set_filter)
+    else:
+        # Load the validated catalog, from its snapshot if it didn't change since the last run
+        with timing.time_stage(timing.STAGE_CATALOG_PARSE):
+            try:
+                catalog = load_catalog(catalog_file_path, get_snapshot_dir_path(config, cache_dir_path))
+            except CatalogError as error:
+                u.log(f"Invalid catalog: {error}. Aborting.")
+                exit(1)
+
+    # Select the sets to generate headers for, in a single pass before any generator work
+    # The jobs of a batch, the server requests and the watch builds select their own sets from the whole catalog
+    if not is_streaming and not args.batch and not args.serve and not args.watch:
+        with timing.time_stage(timing.STAGE_FILTERING):
+            catalog = set_filter.select(catalog)
+
+    # Load the assets manifest, which is updated as needed when sets are looked up
+    asset_manifest = AssetManifest(catalog_assets_dir_path, asset_manifest_file_path, cover_filename_prefix, symbol_filename_prefix)
+    if args.build_manifest:
+        asset_manifest.build()
+        asset_manifest.save()
+        u.log(f"Assets manifest with {len(asset_manifest.sets)} sets written to {asset_manifest_file_path}")
+        exit(0)
+    asset_manifest.load()
+
+    # Set up the data object for the generator
+    generator_data = GeneratorData(
+        catalog = catalog,
+        config = config,
+        output_file_path = output_file_path,
+        catalog_sets_dir_path = catalog_assets_dir_path,
+        imgs_dir_path=imgs_dir_path,
+        fonts_dir_path=fonts_dir_path,
+        frame_imgs_dir_path=frame_imgs_dir_path,
+        cache_dir_path=cache_dir_path,
+        region_filenames = REGION_FILENAMES,
+        cover_filename_prefix = cover_filename_prefix,
+        symbol_filename_prefix = symbol_filename_prefix,
+        asset_manifest = asset_manifest
+    )
+
+    has_skipped_jobs = False
+
+    # While streaming, the catalog is only read (and validated) as the headers are planned
+    try:
+        if args.preflight:
+            print_preflight_report(generator_data)
+            asset_manifest.save()
+            exit(0)
+
+        if args.watch:
+            # Generate the PDF again on every change until interrupted
+            watch(generator_data, catalog_file_path, config_file_path, [catalog_assets_dir_path, imgs_dir_path])
+        elif args.serve:
+            # Render PDFs on request until interrupted
+            serve(generator_data, catalog_file_path, args.host, args.port, config.get("server_cache_max_size_mb", DEFAULT_SERVER_CACHE_MAX_SIZE_MB))
+        elif args.batch:
+            # Generate the PDF of every job of the batch
+            jobs = load_batch_jobs(args.batch, config)
+            job_results = run_batch(generator_data, jobs, args.batch_workers)
+            has_skipped_jobs = any([job_result["error"] for job_result in job_results])
+        else:
+            # Choose the correct generator
+            headers_type = config["headers_type"]
+            if headers_type == "cards":
+                generator = CardGenerator()
+            elif headers_type == "pages":
+                generator = PageGenerator()
+            else:
+                u.log(f"Unknown headers_type value \"{headers_type}\". Aborting.")
+                exit(1)
+
+            if args.plan_only:
+                headers_count = 0
+                pages_count = 0
+                for page_headers in iter_pages(generator.iter_header_layouts(generator_data)):
+                    headers_count += len(page_headers)
+                    pages_count += 1
+                u.log(f"\n{headers_count} headers planned on {pages_count} pages")
+                asset_manifest.save()
+                exit(0)
+
+            if args.shard:
+                # Generate the pages of this shard only
+                shard_index, shards_count = args.shard
+                generate_shard(generator, generator_data, shard_index, shards_count, args.shard_dir)
+            elif args.preview:
+                # Draw the previews of the pages
+                generator.generate_previews(generator_data, os.path.abspath(args.preview))
+            else:
+                # Generate the PDF
+                generator.generate(generator_data)
+    except CatalogError as error:
+        u.log(f"Invalid catalog: {error}. Aborting.")
+        exit(1)
+    except u.ConfigError as error:
+        u.log(f"{error}. Aborting.")
+        exit(1)
+
+    # Save the sets that were scanned again in the assets manifest
+    asset_manifest.save()
+
+    # Keep the assets cache within its maximum size
+    if asset_cache_max_size_mb > 0:
+        asset_cache.evict()
+
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        u.log(f"\nProfile written to {args.profile}, the slowest functions are:")
+        pstats.Stats(profiler).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(20)
+
+    if timing.enabled:
+        u.log("")
+        for line in timing.get_summary_lines():
+            u.log(line)
+        if args.trace:
+            timing.write_trace(args.trace)
+            u.log(f"Trace written to {args.trace}")
+
+    # The other jobs of the batch were generated, but the run still fails if any was skipped
+    if has_skipped_jobs:
+        exit(1)
@@ -0,0 +1,47 @@
+import os
+import json
+import argparse
+
+import scripts.utils as u
+from scripts.golden import run_golden_checks, get_run_name, can_rasterise_pdf, GOLDEN_RUNS
+
+# Get the directory path of the script
+script_dir_path = os.path.dirname(os.path.abspath(__file__))
+
+# Get paths
+goldens_dir_path = os.path.join(script_dir_path, "golden")
+fixture_catalog_file_path = os.path.join(goldens_dir_path, "fixture", "catalog.json")
+expected_dir_path = os.path.join(goldens_dir_path, "expected")
+work_dir_path = os.path.join(script_dir_path, "cache", "golden")
+assets_dir_path = os.path.join(script_dir_path, "assets")
+config_template_file_path = os.path.join(script_dir_path, "config_template.yaml")
+
+# The runs are done in new processes, which import this file again, so only the main process runs the checks
+if __name__ == "__main__":
+    # Parse the command line arguments
+    parser = argparse.ArgumentParser(description="Render the fixture catalog in every mode and check that the layouts and pages still match the goldens.")
+    parser.add_argument("--update", action="store_true", help="replace the goldens with the current output, after checking that the changes are expected")
+    parser.add_argument("--run", action="append", choices=[get_run_name(run_options) for run_options in GOLDEN_RUNS], help="only check this run (can be given multiple times)")
+    parser.add_argument("--output", help="also write the results, with the timings and differences of every run, to this JSON file")
+    args = parser.parse_args()
+
+    # The goldens would be written without their PDF pages, which the following checks could then never compare
+    if args.update and not can_rasterise_pdf():
+        u.log("pymupdf isn't installed, so the PDF pages can't be rasterised, install it with \"pip install -r requirements.txt\". Aborting.")
+        exit(1)
+
+    # Start from the default config, so that results don't depend on the local config.yaml
+    config = u.parse_yaml(config_template_file_path)
+
+    results = run_golden_checks(work_dir_path, expected_dir_path, fixture_catalog_file_path, assets_dir_path, config, args.run, args.update)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(json.dumps(results, indent=2, ensure_ascii=False))
+        u.log(f"Results written to {args.output}")
+
+    different_runs = [result["name"] for result in results if result["differences"]]
+    if different_runs:
+        u.log(f"\n{len(different_runs)} of {len(results)} runs are different from their goldens: {', '.join(different_runs)}")
+        exit(1)
+    u.log(f"\n{len(results)} runs {'updated' if args.update else 'match their goldens'}")
@@ -0,0 +1,141 @@
+import os
+import shutil
+import hashlib
+import threading
+from PIL import Image
+
+# The formats the processed images can be stored in, with the extension of their entries
+ASSET_CACHE_FORMAT_PNG = "png"
+ASSET_CACHE_FORMAT_JPEG = "jpeg"
+ASSET_CACHE_EXTENSIONS = {
+    ASSET_CACHE_FORMAT_PNG: "png",
+    ASSET_CACHE_FORMAT_JPEG: "jpg"
+}
+
+# The extensions of the empty files recording whether the alpha channel of a source image is fully opaque
+ASSET_CACHE_OPACITY_EXTENSIONS = {
+    True: "opaque",
+    False: "transparent"
+}
+ASSET_CACHE_OPACITY_DIR_NAME = "opacity"
+
+BYTES_PER_MB = 1024*1024
+
+
+# An on-disk cache of processed (cropped, resized and encoded) images
+# Each entry is keyed by the content of its source file plus the transform and encoding applied to it,
+# so it stays valid when the source file is moved or touched, and it's never reused when the file changes
+class AssetCache():
+    def __init__(self, cache_dir_path: str, max_size_mb: float):
+        self.cache_dir_path = cache_dir_path
+        self.max_size = max_size_mb * BYTES_PER_MB
+
+    def get_key(self, source_path: str, transform: tuple, image_format: str = ASSET_CACHE_FORMAT_PNG, save_params: dict = {}) -> str:
+        key_data = f"{get_file_hash(source_path)}|{transform!r}|{image_format}"
+        if save_params:
+            key_data += f"|{sorted(save_params.items())!r}"
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+    def get_entry_path(self, key: str, image_format: str = ASSET_CACHE_FORMAT_PNG) -> str:
+        return os.path.join(self.cache_dir_path, key[:2], f"{key}.{ASSET_CACHE_EXTENSIONS[image_format]}")
+
+    # Returns the path of the cached image, or None if it's not in the cache
+    def get(self, key: str, image_format: str = ASSET_CACHE_FORMAT_PNG) -> str:
+        entry_path = self.get_entry_path(key, image_format)
+        try:
+            # Keep track of when the entry was last used, to evict the least recently used ones first
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return None
+        return entry_path
+
+    # Stores the image in the cache and returns the path of the cached image
+    def put(self, key: str, image: Image, image_format: str = ASSET_CACHE_FORMAT_PNG, save_params: dict = {}) -> str:
+        entry_path = self.get_entry_path(key, image_format)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+
+        # Write to a temporary file first, so a cache entry is never seen half-written
+        tmp_entry_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        image.save(tmp_entry_path, format=image_format, **save_params)
+        os.replace(tmp_entry_path, entry_path)
+        return entry_path
+
+    def get_opacity_path(self, source_path: str, is_opaque: bool) -> str:
+        return os.path.join(self.cache_dir_path, ASSET_CACHE_OPACITY_DIR_NAME, f"{get_file_hash(source_path)}.{ASSET_CACHE_OPACITY_EXTENSIONS[is_opaque]}")
+
+    # Returns whether the alpha channel of the source image is fully opaque, or None if it hasn't been recorded yet
+    # It's keyed by the content of the file, so the pixels of an image are only scanned once
+    def get_opacity(self, source_path: str) -> bool:
+        for is_opaque in ASSET_CACHE_OPACITY_EXTENSIONS:
+            if os.path.exists(self.get_opacity_path(source_path, is_opaque)):
+                return is_opaque
+        return None
+
+    def put_opacity(self, source_path: str, is_opaque: bool):
+        opacity_path = self.get_opacity_path(source_path, is_opaque)
+        os.makedirs(os.path.dirname(opacity_path), exist_ok=True)
+        open(opacity_path, "w").close()
+
+    # Returns (path, size, last access time) for every entry in the cache
+    def get_entries(self) -> list:
+        entries = []
+        if not os.path.isdir(self.cache_dir_path):
+            return entries
+
+        entry_extensions = tuple([f".{extension}" for extension in ASSET_CACHE_EXTENSIONS.values()])
+        for dir_entry in os.scandir(self.cache_dir_path):
+            if not dir_entry.is_dir():
+                continue
+            for file_entry in os.scandir(dir_entry.path):
+                if not file_entry.name.endswith(entry_extensions):
+                    continue
+                stat = file_entry.stat()
+                entries.append((file_entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def get_size(self) -> int:
+        return sum([size for _, size, _ in self.get_entries()])
+
+    # Deletes the least recently used entries until the cache fits within its maximum size
+    # Returns the number of deleted entries
+    def evict(self) -> int:
+        entries = self.get_entries()
+        cache_size = sum([size for _, size, _ in entries])
+        entries.sort(key=lambda entry: entry[2])
+
+        evicted = 0
+        for entry_path, size, _ in entries:
+            if cache_size <= self.max_size:
+                break
+            os.remove(entry_path)
+            cache_size -= size
+            evicted += 1
+        return evicted
+
+    # Deletes every entry in the cache
+    # Returns the number of deleted entries
+    def clear(self) -> int:
+        entries = self.get_entries()
+        for entry_path, _, _ in entries:
+            os.remove(entry_path)
+        shutil.rmtree(os.path.join(self.cache_dir_path, ASSET_CACHE_OPACITY_DIR_NAME), ignore_errors=True)
+        return len(entries)
+
+
+# Hashes of the files read during this run, keyed by (path, modification time, size),
+# so a hash is only computed again if the file has been modified since the last time
+file_hashes = {}
+
+
+def get_file_hash(file_path: str) -> str:
+    stat = os.stat(file_path)
+    file_key = (file_path, stat.st_mtime_ns, stat.st_size)
+    if file_key not in file_hashes:
+        with open(file_path, "rb") as f:
+            file_hashes[file_key] = hashlib.sha256(f.read()).hexdigest()
+    return file_hashes[file_key]
+
+
+# Records a hash that is already known (e.g. from the assets manifest), so the file doesn't need to be read again
+def remember_file_hash(file_path: str, mtime_ns: int, size: int, file_hash: str):
+    file_hashes[(file_path, mtime_ns, size)] = file_hash
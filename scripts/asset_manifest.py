@@ -0,0 +1,175 @@
+import os
+import re
+import json
+from PIL import Image
+
+import scripts.utils as u
+from scripts.asset_cache import get_file_hash, remember_file_hash
+
+ASSET_MANIFEST_VERSION = 1
+
+
+# An index of the cover and symbols of every set in the catalog assets folder, with their pixel size and content hash
+# Each set entry is validated against the modification time of its folder and the modification time and size of its files,
+# so only the sets whose files changed are scanned again
+class AssetManifest():
+    def __init__(self, catalog_assets_dir_path: str, manifest_file_path: str, cover_filename_prefix: str, symbol_filename_prefix: str):
+        self.catalog_assets_dir_path = catalog_assets_dir_path
+        self.manifest_file_path = manifest_file_path
+        self.cover_filename_prefix = cover_filename_prefix
+        self.symbol_filename_prefix = symbol_filename_prefix
+        self.sets = {}
+        self.has_changed = False
+
+    def load(self):
+        if not os.path.exists(self.manifest_file_path):
+            return
+        manifest = u.parse_json(self.manifest_file_path)
+        if manifest.get("version") != ASSET_MANIFEST_VERSION:
+            return
+        self.sets = manifest["sets"]
+
+    def save(self):
+        if not self.has_changed:
+            return
+
+        os.makedirs(os.path.dirname(self.manifest_file_path), exist_ok=True)
+        # Write to a temporary file first, so the manifest is never seen half-written
+        tmp_manifest_file_path = f"{self.manifest_file_path}.{os.getpid()}.tmp"
+        with open(tmp_manifest_file_path, "w", encoding="utf-8") as f:
+            json.dump({"version": ASSET_MANIFEST_VERSION, "sets": self.sets}, f, indent=2, sort_keys=True)
+        os.replace(tmp_manifest_file_path, self.manifest_file_path)
+        self.has_changed = False
+
+    # Scans every set folder in the catalog assets folder, from scratch
+    def build(self):
+        self.sets = {}
+        for serie_id in sorted(os.listdir(self.catalog_assets_dir_path)):
+            serie_dir_path = os.path.join(self.catalog_assets_dir_path, serie_id)
+            if not os.path.isdir(serie_dir_path):
+                continue
+            for set_id in sorted(os.listdir(serie_dir_path)):
+                if os.path.isdir(os.path.join(serie_dir_path, set_id)):
+                    self.sets[get_set_key(serie_id, set_id)] = self.scan_set(serie_id, set_id)
+        self.has_changed = True
+
+    # Returns the path of the set cover (or None) and the paths of the set symbols, in order
+    def get_set_assets(self, serie_id: str, set_id: str) -> tuple:
+        set_key = get_set_key(serie_id, set_id)
+        set_entry = self.sets.get(set_key)
+        if set_entry is None or not self.is_set_entry_valid(serie_id, set_id, set_entry):
+            set_entry = self.scan_set(serie_id, set_id)
+            self.sets[set_key] = set_entry
+            self.has_changed = True
+
+        set_dir_path = self.get_set_dir_path(serie_id, set_id)
+        set_cover_path = None
+        if set_entry["cover"]:
+            set_cover_path = os.path.join(set_dir_path, set_entry["cover"]["file"])
+        set_symbol_paths = [os.path.join(set_dir_path, symbol["file"]) for symbol in set_entry["symbols"]]
+        return set_cover_path, set_symbol_paths
+
+    def get_set_dir_path(self, serie_id: str, set_id: str) -> str:
+        return os.path.join(self.catalog_assets_dir_path, serie_id, set_id)
+
+    def is_set_entry_valid(self, serie_id: str, set_id: str, set_entry: dict) -> bool:
+        set_dir_path = self.get_set_dir_path(serie_id, set_id)
+        try:
+            set_dir_mtime_ns = os.stat(set_dir_path).st_mtime_ns
+        except FileNotFoundError:
+            return set_entry["dir_mtime_ns"] is None
+        if set_dir_mtime_ns != set_entry["dir_mtime_ns"]:
+            return False
+
+        set_files = get_set_entry_files(set_entry)
+        for set_file in set_files:
+            try:
+                stat = os.stat(os.path.join(set_dir_path, set_file["file"]))
+            except FileNotFoundError:
+                return False
+            if stat.st_mtime_ns != set_file["mtime_ns"] or stat.st_size != set_file["size"]:
+                return False
+
+        # The hashes are still valid, so they don't need to be computed again by the caches
+        for set_file in set_files:
+            file_path = os.path.join(set_dir_path, set_file["file"])
+            remember_file_hash(file_path, set_file["mtime_ns"], set_file["size"], set_file["sha256"])
+        return True
+
+    def scan_set(self, serie_id: str, set_id: str) -> dict:
+        set_entry = {
+            "dir_mtime_ns": None,
+            "cover": None,
+            "symbols": []
+        }
+
+        set_dir_path = self.get_set_dir_path(serie_id, set_id)
+        if not os.path.isdir(set_dir_path):
+            return set_entry
+
+        set_entry["dir_mtime_ns"] = os.stat(set_dir_path).st_mtime_ns
+        # Sorted naturally, so that "symbol2" comes after "symbol" and before "symbol10"
+        set_files = sorted(os.listdir(set_dir_path), key=get_natural_sort_key)
+        for file in set_files:
+            file_path = os.path.join(set_dir_path, file)
+            if file.startswith(self.cover_filename_prefix) and not set_entry["cover"]:
+                set_entry["cover"] = describe_file(file_path)
+            if file.startswith(self.symbol_filename_prefix):
+                set_entry["symbols"].append(describe_file(file_path))
+        return set_entry
+
+
+# Prints the included sets with a missing cover or symbol, without rendering anything
+def print_preflight_report(data):
+    sets_count = 0
+    missing_covers_count = 0
+    missing_symbols_count = 0
+    for serie in data.catalog:
+        serie_id = serie.id
+        for set in serie.sets:
+            set_id = set.id
+
+            sets_count += 1
+            set_cover_path, set_symbol_paths = data.asset_manifest.get_set_assets(serie_id, set_id)
+            missing = []
+            if not set_cover_path:
+                missing.append("cover")
+                missing_covers_count += 1
+            if not set_symbol_paths:
+                missing.append("symbol")
+                missing_symbols_count += 1
+            if missing:
+                u.log(f"{get_set_key(serie_id, set_id)}: missing {' and '.join(missing)}", 1)
+
+    u.log(f"{sets_count} sets checked, {missing_covers_count} without a cover, {missing_symbols_count} without symbols")
+
+
+def get_set_key(serie_id: str, set_id: str) -> str:
+    return f"{serie_id}/{set_id}"
+
+
+def get_set_entry_files(set_entry: dict) -> list:
+    set_files = list(set_entry["symbols"])
+    if set_entry["cover"]:
+        set_files.append(set_entry["cover"])
+    return set_files
+
+
+def describe_file(file_path: str) -> dict:
+    stat = os.stat(file_path)
+    with Image.open(file_path) as image:
+        width, height = image.size
+    return {
+        "file": os.path.basename(file_path),
+        "width": width,
+        "height": height,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": get_file_hash(file_path)
+    }
+
+
+def get_natural_sort_key(file_name: str) -> tuple:
+    stem, extension = os.path.splitext(file_name)
+    stem_parts = [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", stem)]
+    return (stem_parts, extension)
@@ -0,0 +1,158 @@
+import io
+import os
+import copy
+import time
+import hashlib
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+import scripts.utils as u
+import scripts.timing as timing
+from scripts.set_filter import SetFilter, FilterError
+from scripts.generators.generator import init_worker
+from scripts.generators.card_generator import CardGenerator
+from scripts.generators.page_generator import PageGenerator
+
+BATCH_JOB_OUTPUT_KEY = "output"
+
+GENERATORS = {
+    "cards": CardGenerator,
+    "pages": PageGenerator
+}
+
+# The generator data of the batch, set up once in each batch worker process by init_batch_worker
+batch_data = None
+
+
+# Reads the jobs of a batch file, a list of jobs each with the path of its output PDF (relative to the batch file)
+# and the config values it changes from the base config
+def load_batch_jobs(batch_file_path: str, base_config: dict) -> list:
+    jobs = u.parse_yaml(batch_file_path)
+    if not isinstance(jobs, list) or not jobs:
+        u.log(f"The batch file {batch_file_path} should be a list of jobs. Aborting.")
+        exit(1)
+
+    batch_dir_path = os.path.dirname(os.path.abspath(batch_file_path))
+    output_file_paths = set()
+    for job_index, job in enumerate(jobs):
+        if not isinstance(job, dict) or not job.get(BATCH_JOB_OUTPUT_KEY):
+            u.log(f"Batch job {job_index + 1} has no \"{BATCH_JOB_OUTPUT_KEY}\" path. Aborting.")
+            exit(1)
+
+        job[BATCH_JOB_OUTPUT_KEY] = os.path.normpath(os.path.join(batch_dir_path, job[BATCH_JOB_OUTPUT_KEY]))
+        if job[BATCH_JOB_OUTPUT_KEY] in output_file_paths:
+            u.log(f"Batch job {job_index + 1} has the same output as a previous job, {job[BATCH_JOB_OUTPUT_KEY]}. Aborting.")
+            exit(1)
+        output_file_paths.add(job[BATCH_JOB_OUTPUT_KEY])
+
+    return jobs
+
+
+# The generator of the headers_type of the config
+def get_generator(config: dict):
+    headers_type = config.get("headers_type")
+    if headers_type not in GENERATORS:
+        raise u.ConfigError(f"Unknown headers_type value \"{headers_type}\"")
+    return GENERATORS[headers_type]()
+
+
+# Generates the PDF of every job in the same process, or across batch_workers processes,
+# so the parsed catalog, the registered fonts, the measured texts and the assets manifest and cache are shared by the jobs
+# Jobs with an invalid config or filter are skipped, and listed in the summary with the reason
+# Returns the result of each job (see run_batch_job), in order
+def run_batch(data, jobs: list, batch_workers: int) -> list:
+    start_time = time.perf_counter()
+
+    job_results = []
+    if batch_workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=batch_workers, initializer=init_batch_worker, initargs=(data, u.asset_cache, timing.enabled)) as executor:
+            futures = [executor.submit(run_batch_job_in_worker, job_index, len(jobs), job) for job_index, job in enumerate(jobs)]
+            for future in futures:
+                job_result, job_log, job_timing_events = future.result()
+                # Each job logs to the console once it's done, so the logs of the jobs aren't mixed up
+                print(job_log, end="")
+                timing.add_events(job_timing_events)
+                job_results.append(job_result)
+    else:
+        for job_index, job in enumerate(jobs):
+            job_results.append(run_batch_job(data, job_index, len(jobs), job))
+
+    generated_count = len([job_result for job_result in job_results if not job_result["error"]])
+    u.log(f"\n{generated_count} of {len(jobs)} PDFs generated in {time.perf_counter() - start_time:.1f} s")
+    for job_result in job_results:
+        if job_result["error"]:
+            u.log(f"{job_result['output']}: skipped, {job_result['error']}", 1)
+        else:
+            u.log(f"{job_result['output']}: {job_result['time_s']:.1f} s, {job_result['size_bytes'] / (1024*1024):.1f} MB", 1)
+    return job_results
+
+
+# Generates the PDF of a single job, with the catalog selected by the job's filters
+# Returns the output path of the job, how long it took and the size of its PDF, or why it was skipped
+def run_batch_job(data, job_index: int, jobs_count: int, job: dict) -> dict:
+    output_file_path = job[BATCH_JOB_OUTPUT_KEY]
+    u.log(f"\n[{job_index + 1}/{jobs_count}] {output_file_path}")
+    start_time = time.perf_counter()
+
+    config = get_job_config(data.config, job)
+    u.set_font_selection(config.get("font_selection", u.FONT_SELECTION_RANGES))
+    u.set_jpeg_quality(config.get("jpeg_quality", u.DEFAULT_JPEG_QUALITY))
+
+    # The jobs share everything else, but each has its own config, sets, output and rendered pages
+    job_data = copy.copy(data)
+    job_data.config = config
+    job_data.output_file_path = output_file_path
+    job_data.page_cache_dir_path = os.path.join(data.cache_dir_path, "batch", get_job_key(output_file_path), "pages")
+    try:
+        with timing.time_stage(timing.STAGE_FILTERING):
+            job_data.catalog = SetFilter(config["filters"]).select(data.catalog)
+
+        generator = get_generator(config)
+        os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+        generator.generate(job_data)
+    except FilterError as error:
+        return get_skipped_job_result(output_file_path, f"invalid filter {error}")
+    except u.ConfigError as error:
+        return get_skipped_job_result(output_file_path, str(error))
+
+    return {
+        "output": output_file_path,
+        "error": None,
+        "time_s": time.perf_counter() - start_time,
+        "size_bytes": os.path.getsize(output_file_path)
+    }
+
+
+def get_skipped_job_result(output_file_path: str, error: str) -> dict:
+    u.log(f"Skipping the job: {error}", 1)
+    return {
+        "output": output_file_path,
+        "error": error,
+        "time_s": 0,
+        "size_bytes": 0
+    }
+
+
+# The base config with the values set by the job
+def get_job_config(base_config: dict, job: dict) -> dict:
+    return dict(base_config, **{key: value for key, value in job.items() if key != BATCH_JOB_OUTPUT_KEY})
+
+
+# Identifies the job by its output, so each output keeps its own rendered pages across builds
+def get_job_key(output_file_path: str) -> str:
+    return hashlib.sha256(os.path.abspath(output_file_path).encode("utf-8")).hexdigest()[:16]
+
+
+def init_batch_worker(data, asset_cache, timing_enabled: bool):
+    global batch_data
+    batch_data = data
+    init_worker(data, asset_cache, timing_enabled)
+
+
+# Runs the job in a batch worker process, returning its result along with what it logged and its timed stages
+# The jobs are already spread across processes, so each job renders its pages in its worker process only
+def run_batch_job_in_worker(job_index: int, jobs_count: int, job: dict) -> tuple:
+    job_log = io.StringIO()
+    with contextlib.redirect_stdout(job_log):
+        job_result = run_batch_job(batch_data, job_index, jobs_count, dict(job, workers=1))
+    return job_result, job_log.getvalue(), timing.collect_events()
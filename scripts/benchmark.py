@@ -0,0 +1,176 @@
+import io
+import os
+import sys
+import time
+import shutil
+import platform
+import subprocess
+import contextlib
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the peak memory usage isn't reported
+    resource = None
+
+import scripts.utils as u
+import scripts.timing as timing
+from scripts.asset_cache import AssetCache
+from scripts.asset_manifest import AssetManifest
+from scripts.set_filter import SetFilter
+from scripts.catalog import load_catalog
+from scripts.generator_data import GeneratorData, REGION_FILENAMES, COVER_FILENAME_PREFIX, SYMBOL_FILENAME_PREFIX
+from scripts.batch import GENERATORS
+
+BENCHMARK_VERSION = 2
+
+# The generator and layout options of each benchmark run
+BENCHMARK_RUNS = [
+    {"headers_type": "cards", "cards_alignment": "spaced"},
+    {"headers_type": "cards", "cards_alignment": "packed"},
+    {"headers_type": "pages"}
+]
+
+# Each mode is run from an empty cache first, then again with the cache filled by the first run
+BENCHMARK_CACHE_COLD = "cold"
+BENCHMARK_CACHE_WARM = "warm"
+BENCHMARK_CACHE_STATES = [BENCHMARK_CACHE_COLD, BENCHMARK_CACHE_WARM]
+
+
+# The paths used by a benchmark run
+# Each mode gets its own output file and cache folder, so the modes don't benefit from each other
+class BenchmarkPaths():
+    def __init__(self, benchmark_dir_path: str, catalog_file_path: str, assets_dir_path: str, run_name: str):
+        self.catalog_file_path = catalog_file_path
+        self.catalog_assets_dir_path = os.path.join(os.path.dirname(catalog_file_path), "assets")
+        self.imgs_dir_path = os.path.join(assets_dir_path, "imgs")
+        self.frame_imgs_dir_path = os.path.join(self.imgs_dir_path, "frame")
+        self.fonts_dir_path = os.path.join(assets_dir_path, "fonts")
+        self.output_file_path = os.path.join(benchmark_dir_path, "output", f"{run_name}.pdf")
+        self.cache_dir_path = os.path.join(benchmark_dir_path, "cache", run_name)
+
+
+# Runs every generator in every layout mode against the catalog, each in a new process, and returns the results
+def run_benchmarks(benchmark_dir_path: str, catalog_file_path: str, assets_dir_path: str, base_config: dict, catalog_info: dict) -> dict:
+    runs = []
+    for run_options in BENCHMARK_RUNS:
+        run_name = "-".join(run_options.values())
+        paths = BenchmarkPaths(benchmark_dir_path, catalog_file_path, assets_dir_path, run_name)
+        config = dict(base_config, **run_options)
+
+        for cache_state in BENCHMARK_CACHE_STATES:
+            u.log(f"Running {run_name} ({cache_state} cache)")
+            # A new process per run, so fonts, in-memory caches and peak memory usage start from scratch
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                run_result = executor.submit(run_benchmark, paths, config, cache_state == BENCHMARK_CACHE_COLD).result()
+            u.log(f"{run_result['wall_time_s']:.2f} s, {run_result['output_size_bytes'] / (1024*1024):.1f} MB", 1)
+            for stage, stage_result in run_result["timed_stages"].items():
+                u.log(f"{stage}: {stage_result['total_s']:.2f} s ({stage_result['calls']} calls)", 2)
+            runs.append(dict(run_options, cache=cache_state, **run_result))
+
+    return {
+        "version": BENCHMARK_VERSION,
+        "revision": get_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "catalog": catalog_info,
+        "config": base_config,
+        "runs": runs
+    }
+
+
+# Generates the PDF as generate.py does, timing each stage, from an empty cache or with the cache of the previous run
+# The stages timed within the generation (e.g. image processing, text fitting or saving) are reported as well
+def run_benchmark(paths: BenchmarkPaths, config: dict, clear_cache: bool) -> dict:
+    if clear_cache:
+        shutil.rmtree(paths.cache_dir_path, ignore_errors=True)
+    os.makedirs(paths.cache_dir_path, exist_ok=True)
+    os.makedirs(os.path.dirname(paths.output_file_path), exist_ok=True)
+    timing.enable()
+
+    stages = {}
+    start_time = time.perf_counter()
+    # The generators log every set, which isn't needed here
+    with contextlib.redirect_stdout(io.StringIO()):
+        stage_start_time = time.perf_counter()
+        data = get_generator_data(paths, config)
+        generator = GENERATORS[config["headers_type"]]()
+        stages["setup"] = time.perf_counter() - stage_start_time
+
+        stage_start_time = time.perf_counter()
+        header_layouts = generator.plan_headers(data)
+        stages["plan"] = time.perf_counter() - stage_start_time
+
+        stage_start_time = time.perf_counter()
+        generator.render(data, header_layouts)
+        stages["render"] = time.perf_counter() - stage_start_time
+    wall_time = time.perf_counter() - start_time
+
+    return {
+        "wall_time_s": round(wall_time, 3),
+        "stages_s": {stage: round(stage_time, 3) for stage, stage_time in stages.items()},
+        "timed_stages": get_timed_stages(),
+        "peak_rss_mb": get_peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+        "peak_workers_rss_mb": get_peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+        "headers": len(header_layouts),
+        "pages": len(set([header_layout.page for header_layout in header_layouts])),
+        "output_size_bytes": os.path.getsize(paths.output_file_path)
+    }
+
+
+# Sets up the utils module and the generator data as generate.py does, with the catalog, caches and output of the run
+def get_generator_data(paths: BenchmarkPaths, config: dict) -> GeneratorData:
+    u.init(paths.fonts_dir_path, paths.frame_imgs_dir_path, os.path.join(paths.cache_dir_path, "fonts"))
+    u.set_font_selection(config.get("font_selection", u.FONT_SELECTION_RANGES))
+    u.set_jpeg_quality(config.get("jpeg_quality", u.DEFAULT_JPEG_QUALITY))
+    asset_cache_max_size_mb = config.get("asset_cache_max_size_mb", 0)
+    if asset_cache_max_size_mb > 0:
+        u.set_asset_cache(AssetCache(os.path.join(paths.cache_dir_path, "assets"), asset_cache_max_size_mb))
+
+    catalog = SetFilter(config["filters"]).select(load_catalog(paths.catalog_file_path))
+    asset_manifest = AssetManifest(paths.catalog_assets_dir_path, os.path.join(paths.cache_dir_path, "asset_manifest.json"), COVER_FILENAME_PREFIX, SYMBOL_FILENAME_PREFIX)
+    asset_manifest.load()
+    return GeneratorData(
+        catalog = catalog,
+        config = config,
+        output_file_path = paths.output_file_path,
+        catalog_sets_dir_path = paths.catalog_assets_dir_path,
+        imgs_dir_path = paths.imgs_dir_path,
+        fonts_dir_path = paths.fonts_dir_path,
+        frame_imgs_dir_path = paths.frame_imgs_dir_path,
+        cache_dir_path = paths.cache_dir_path,
+        region_filenames = REGION_FILENAMES,
+        cover_filename_prefix = COVER_FILENAME_PREFIX,
+        symbol_filename_prefix = SYMBOL_FILENAME_PREFIX,
+        asset_manifest = asset_manifest
+    )
+
+
+# How many times each timed stage ran and for how long in total, including the worker processes
+def get_timed_stages() -> dict:
+    summary = timing.get_summary()
+    timed_stages = {}
+    for stage in timing.get_ordered_stages(summary):
+        calls, total_duration = summary[stage]
+        timed_stages[stage] = {"calls": calls, "total_s": round(total_duration, 3)}
+    return timed_stages
+
+
+def get_peak_rss_mb(who: int) -> float:
+    peak_rss = resource.getrusage(who).ru_maxrss
+    # Reported in bytes on macOS, and in kilobytes elsewhere
+    if sys.platform == "darwin":
+        return round(peak_rss / (1024*1024), 1)
+    return round(peak_rss / 1024, 1)
+
+
+# The current git commit, with a "-dirty" suffix if there are uncommitted changes, or None if git isn't available
+def get_revision() -> str:
+    try:
+        repo_dir_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=repo_dir_path, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,242 @@
+import os
+import re
+import sys
+import pickle
+import hashlib
+from functools import lru_cache
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+import scripts.utils as u
+from scripts.asset_cache import get_file_hash
+
+CATALOG_SNAPSHOT_VERSION = 1
+CATALOG_SNAPSHOT_EXTENSION = ".pickle"
+
+DEFAULT_REGION = "eng"
+
+# Catalog dates are written as "DD/MM/YYYY", "MM/YYYY" or "YYYY"
+DATE_PATTERN = re.compile(r"^(?:(?:(\d{1,2})/)?(\d{1,2})/)?(\d{4})$")
+
+SERIE_KEYS = {"id", "name", "sets"}
+SET_KEYS = {"id", "names", "region", "date"}
+
+
+# Raised with the location and reason of the first malformed entry of the catalog
+class CatalogError(Exception):
+    pass
+
+
+# The records of the catalog, built once when the catalog is loaded and never modified afterwards,
+# so they can be shared by the generators, the jobs of a batch, the server requests and the watch builds
+# They are named tuples, which are compact and are pickled (to the snapshot and to worker processes) without calling any Python code
+
+
+# A serie of the catalog, with its sets in order
+class CatalogSerie(NamedTuple):
+    id: str
+    name: Optional[str]
+    sets: tuple
+
+    # What the serie is logged as: its name, or its id when it has none
+    @property
+    def print_name(self) -> str:
+        return self.name or f"<{self.id}>"
+
+    # Returns the same serie with only the given sets
+    def with_sets(self, sets: list):
+        return self._replace(sets=tuple(sets))
+
+
+# A set of the catalog
+# The region is "eng" when not specified in the catalog (has_region tells whether it was)
+# The name is the one of the set region, and the alternative name the English one for the sets of other regions,
+# each split into the rows given in the catalog and joined into a single row (without spaces for Asian texts)
+# The search names are the names of every region on a single row, casefolded, for the name selectors of the filters
+# The date is also parsed into a (year, month, day) tuple, shortened to (year, month) or (year,) for partial dates
+class CatalogSet(NamedTuple):
+    id: str
+    serie_id: str
+    region: str
+    has_region: bool
+    date: Optional[str]
+    parsed_date: Optional[tuple]
+    name: Optional[str]
+    name_rows: tuple
+    name_alt: Optional[str]
+    name_alt_rows: tuple
+    search_names: tuple
+
+    # What the set is logged as: its name followed by its alternative name, or its id when it has neither
+    @property
+    def print_name(self) -> str:
+        if self.name:
+            return f"{self.name} ({self.name_alt})" if self.name_alt else self.name
+        return self.name_alt or f"<{self.id}>"
+
+
+# Loads and validates the catalog file, raising a CatalogError on the first malformed entry
+# With a snapshot folder, the records are also saved to a snapshot keyed by the content of the catalog file,
+# which the next runs load instead as long as neither the catalog nor the code building the records changed
+def load_catalog(catalog_file_path: str, snapshot_dir_path: str = None) -> list:
+    if not snapshot_dir_path:
+        return list(iter_catalog_series(u.parse_json(catalog_file_path)))
+
+    snapshot_file_path = os.path.join(snapshot_dir_path, f"{get_snapshot_key(catalog_file_path)}{CATALOG_SNAPSHOT_EXTENSION}")
+    if os.path.exists(snapshot_file_path):
+        with open(snapshot_file_path, "rb") as f:
+            return pickle.load(f)
+
+    catalog = list(iter_catalog_series(u.parse_json(catalog_file_path)))
+
+    # Only keep the snapshot of the latest catalog
+    os.makedirs(snapshot_dir_path, exist_ok=True)
+    for file_name in os.listdir(snapshot_dir_path):
+        if file_name.endswith(CATALOG_SNAPSHOT_EXTENSION):
+            os.remove(os.path.join(snapshot_dir_path, file_name))
+
+    # Write to a temporary file first, so a snapshot is never seen half-written
+    tmp_snapshot_file_path = f"{snapshot_file_path}.{os.getpid()}.tmp"
+    with open(tmp_snapshot_file_path, "wb") as f:
+        pickle.dump(catalog, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_snapshot_file_path, snapshot_file_path)
+    return catalog
+
+
+# The folder the catalog snapshot is kept in, or None if the config disables it
+def get_snapshot_dir_path(config: dict, cache_dir_path: str) -> str:
+    if not config.get("catalog_snapshot", False):
+        return None
+    return os.path.join(cache_dir_path, "catalog")
+
+
+# The snapshot of a catalog depends on the content of the catalog file and on how the records are built,
+# i.e. this file and the utils module, whose Asian character ranges decide how the rows of the names are joined
+def get_snapshot_key(catalog_file_path: str) -> str:
+    code_hashes = "|".join([get_file_hash(os.path.abspath(code_file_path)) for code_file_path in [__file__, u.__file__]])
+    snapshot_key_data = f"{CATALOG_SNAPSHOT_VERSION}|{get_file_hash(catalog_file_path)}|{code_hashes}"
+    return hashlib.sha256(snapshot_key_data.encode("utf-8")).hexdigest()
+
+
+# The series of a catalog file, read from the file one at a time whenever they are iterated,
+# so a catalog of any size can be generated without ever holding all of it in memory
+class StreamedCatalog():
+    def __init__(self, catalog_file_path: str, set_filter):
+        self.catalog_file_path = catalog_file_path
+        self.set_filter = set_filter
+
+    def __iter__(self) -> Iterator[CatalogSerie]:
+        return self.set_filter.iter_select(iter_catalog_series(u.iter_json_array(self.catalog_file_path)))
+
+
+# Validates the raw series (as parsed from the catalog JSON) and builds their records, one serie at a time
+def iter_catalog_series(raw_series: Iterable) -> Iterator[CatalogSerie]:
+    if not isinstance(raw_series, (list, Iterator)):
+        raise CatalogError("the catalog should be a list of series")
+
+    serie_ids = set()
+    for serie_index, raw_serie in enumerate(raw_series):
+        serie = build_serie(raw_serie, f"serie #{serie_index + 1}")
+        if serie.id in serie_ids:
+            raise CatalogError(f"serie \"{serie.id}\" is listed more than once")
+        serie_ids.add(serie.id)
+        yield serie
+
+
+def build_serie(raw_serie, location: str) -> CatalogSerie:
+    if not isinstance(raw_serie, dict):
+        raise CatalogError(f"{location} should be an object")
+    serie_id = get_text_value(raw_serie, "id", location, is_required=True)
+    location = f"serie \"{serie_id}\""
+    check_keys(raw_serie, SERIE_KEYS, location)
+    serie_name = get_text_value(raw_serie, "name", location)
+
+    raw_sets = raw_serie.get("sets", [])
+    if not isinstance(raw_sets, list):
+        raise CatalogError(f"\"sets\" of {location} should be a list")
+
+    sets = []
+    set_ids = set()
+    for set_index, raw_set in enumerate(raw_sets):
+        catalog_set = build_set(raw_set, serie_id, f"set #{set_index + 1} of {location}")
+        if catalog_set.id in set_ids:
+            raise CatalogError(f"set \"{catalog_set.id}\" of {location} is listed more than once")
+        set_ids.add(catalog_set.id)
+        sets.append(catalog_set)
+
+    return CatalogSerie(serie_id, serie_name, tuple(sets))
+
+
+def build_set(raw_set, serie_id: str, location: str) -> CatalogSet:
+    if not isinstance(raw_set, dict):
+        raise CatalogError(f"{location} should be an object")
+    set_id = get_text_value(raw_set, "id", location, is_required=True)
+    location = f"set \"{set_id}\" of serie \"{serie_id}\""
+    check_keys(raw_set, SET_KEYS, location)
+
+    region = get_text_value(raw_set, "region", location)
+    has_region = region is not None
+    # The few regions are shared by every set rather than each having its own copy
+    region = sys.intern(region) if has_region else DEFAULT_REGION
+
+    names = raw_set.get("names", {})
+    if not isinstance(names, dict) or not all([isinstance(name, str) for name in names.values()]):
+        raise CatalogError(f"\"names\" of {location} should be an object of texts by region")
+
+    date = get_text_value(raw_set, "date", location)
+    parsed_date = None
+    if date is not None:
+        date = sys.intern(date)
+        parsed_date = parse_date(date)
+        if parsed_date is None:
+            raise CatalogError(f"\"date\" of {location} should be in the \"DD/MM/YYYY\", \"MM/YYYY\" or \"YYYY\" format, not \"{date}\"")
+
+    # The name of the set region, and the English one as the alternative name of the other regions
+    name, name_rows = get_joined_name(names.get(region))
+    name_alt, name_alt_rows = None, ()
+    if region != DEFAULT_REGION:
+        name_alt, name_alt_rows = get_joined_name(names.get(DEFAULT_REGION))
+
+    search_names = tuple([raw_name.replace("\n", " ").casefold() for raw_name in names.values()])
+
+    return CatalogSet(set_id, serie_id, region, has_region, date, parsed_date, name, name_rows, name_alt, name_alt_rows, search_names)
+
+
+# Returns the name joined into a single row, and its rows as given in the catalog
+# Names on a single row (most of them) are kept as they are, rather than copied
+def get_joined_name(raw_name: str) -> tuple:
+    if raw_name is None:
+        return None, ()
+    if "\n" not in raw_name:
+        return raw_name, (raw_name,)
+    name_rows = tuple(raw_name.split("\n"))
+    name_separator = "" if u.text_contains_asian_chars(raw_name) else " "
+    return name_separator.join(name_rows), name_rows
+
+
+# Returns the date as a (year, month, day) tuple, shortened to (year, month) or (year,) for partial dates, or None if it isn't a date
+# Many sets are released on the same dates, so they share the parsed tuples
+@lru_cache(maxsize=None)
+def parse_date(date_string: str) -> tuple:
+    match = DATE_PATTERN.match(date_string.strip())
+    if not match:
+        return None
+    day, month, year = match.groups()
+    return tuple([int(part) for part in [year, month, day] if part is not None])
+
+
+# Keys the generators don't know about (e.g. notes added to the catalog) are ignored, but logged in case of a typo
+def check_keys(raw_entry: dict, known_keys: set, location: str):
+    unknown_keys = sorted(set(raw_entry) - known_keys)
+    if unknown_keys:
+        unknown_keys_text = ", ".join([f"\"{key}\"" for key in unknown_keys])
+        u.log(f"Ignoring the unknown keys {unknown_keys_text} of {location} in the catalog")
+
+
+def get_text_value(raw_entry: dict, key: str, location: str, is_required: bool = False) -> str:
+    value = raw_entry.get(key)
+    if value is None and not is_required:
+        return None
+    if not isinstance(value, str) or (is_required and not value):
+        raise CatalogError(f"\"{key}\" of {location} should be a{' non-empty' if is_required else ''} text")
+    return value
+
@@ -0,0 +1,73 @@
+import os
+import pickle
+import hashlib
+import operator
+from functools import partial
+from weakref import WeakKeyDictionary
+from reportlab import Version as reportlab_version
+from reportlab.pdfbase.ttfonts import TTFont, TTFontFace
+
+from scripts.asset_cache import get_file_hash
+
+
+# Loads a TrueType font, reusing the parsed font stored in the cache folder when available
+# Entries are keyed by the content of the font file, the font name and the reportlab version that parsed it
+def load_font(font_name: str, font_path: str, cache_dir_path: str = None) -> TTFont:
+    if not cache_dir_path:
+        return TTFont(font_name, font_path)
+
+    key_data = f"{get_file_hash(font_path)}|{font_name}|{reportlab_version}"
+    key = hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+    entry_path = os.path.join(cache_dir_path, f"{key}.pickle")
+
+    if os.path.exists(entry_path):
+        try:
+            with open(entry_path, "rb") as f:
+                return unpickle_font(f.read())
+        except Exception:
+            # A broken entry is simply parsed and written again
+            pass
+
+    font = TTFont(font_name, font_path)
+
+    # Write to a temporary file first, so an entry is never seen half-written
+    os.makedirs(cache_dir_path, exist_ok=True)
+    tmp_entry_path = f"{entry_path}.{os.getpid()}.tmp"
+    with open(tmp_entry_path, "wb") as f:
+        f.write(pickle_font(font))
+    os.replace(tmp_entry_path, entry_path)
+
+    return font
+
+
+# TTFont can't be pickled as is, because of its per-document state and the scaling function of its face,
+# so those are left out and recreated when unpickling
+def pickle_font(font: TTFont) -> bytes:
+    font_attributes = {key: value for key, value in vars(font).items() if key not in ["face", "state"]}
+    face_attributes = {key: value for key, value in vars(font.face).items() if key != "_pdfScale"}
+    return pickle.dumps((font_attributes, face_attributes), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def unpickle_font(data: bytes) -> TTFont:
+    font_attributes, face_attributes = pickle.loads(data)
+
+    face = TTFontFace.__new__(TTFontFace)
+    face.__dict__.update(face_attributes)
+    face._pdfScale = get_pdf_scale(face.unitsPerEm)
+
+    font = TTFont.__new__(TTFont)
+    font.__dict__.update(font_attributes)
+    font.face = face
+    font.state = WeakKeyDictionary()
+    return font
+
+
+# Same scaling from font units to PDF units (1000 per em) that reportlab sets up when parsing the font
+def get_pdf_scale(units_per_em: int):
+    if units_per_em == 1000:
+        return keep_units
+    return partial(operator.mul, 1000 / units_per_em)
+
+
+def keep_units(x):
+    return x
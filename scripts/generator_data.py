@@ -1,3 +1,16 @@
+import os
+
+# The region symbol drawn for each set region, in the assets images folder
+REGION_FILENAMES = {
+    # "all": "jpn-eng.jpg",
+    "all": "eng-jpn.jpg",
+    "eng": "eng.png",
+    "jpn": "jpn.jpg"
+}
+
+COVER_FILENAME_PREFIX = "cover."
+SYMBOL_FILENAME_PREFIX = "symbol"
+
 # The data needed by generators to generate the headers
 class GeneratorData():
     def __init__(
@@ -7,14 +20,25 @@ class GeneratorData():
             output_file_path,
             catalog_sets_dir_path,
             imgs_dir_path,
+            fonts_dir_path,
+            frame_imgs_dir_path,
+            cache_dir_path,
             region_filenames,
             cover_filename_prefix,
-            symbol_filename_prefix):
+            symbol_filename_prefix,
+            asset_manifest,
+            page_cache_dir_path = None):
         self.catalog = catalog
         self.config = config
         self.output_file_path = output_file_path
         self.catalog_assets_dir_path = catalog_sets_dir_path
         self.imgs_dir_path = imgs_dir_path
+        self.fonts_dir_path = fonts_dir_path
+        self.frame_imgs_dir_path = frame_imgs_dir_path
+        self.cache_dir_path = cache_dir_path
         self.region_filenames = region_filenames
         self.cover_filename_prefix = cover_filename_prefix
         self.symbol_filename_prefix = symbol_filename_prefix
+        self.asset_manifest = asset_manifest
+        # Where the incremental builds keep the rendered pages, which only hold the pages of the latest build of each output
+        self.page_cache_dir_path = page_cache_dir_path or os.path.join(cache_dir_path, "pages")
@@ -0,0 +1,352 @@
+import os
+import json
+import math
+import hashlib
+import tempfile
+from typing import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+import scripts.utils as u
+import scripts.timing as timing
+from scripts.asset_cache import get_file_hash
+from scripts.image_prefetcher import ImagePrefetcher
+from scripts.layout import HeaderLayout, TextLayout, LineLayout, ImageLayout, FrameLayout
+from scripts.pdf_stream_writer import PdfStreamWriter
+from scripts.preview_renderer import get_preview_options, render_page_previews, PREVIEW_FILENAME_PREFIX
+
+# Config values that don't change how a page looks, so they are left out of the page fingerprints
+NON_RENDERING_CONFIG_KEYS = [
+    "filters", "workers", "incremental", "asset_cache_max_size_mb", "prefetch_depth", "server_cache_max_size_mb", "streaming_chunk_pages",
+    "catalog_snapshot", "preview_dpi", "preview_format", "preview_headers"]
+
+# How many chunks of pages each worker gets, so that a slow chunk doesn't keep the other workers idle
+CHUNKS_PER_WORKER = 2
+
+# The base class of the generators
+# Subclasses collect the headers to draw (logging them to console) and plan the layout of each of them,
+# while this class takes care of rendering the planned pages to PDF, either serially or across multiple processes
+class Generator():
+    page_size = A4
+
+    def generate(self, data):
+        if data.config.get("streaming_chunk_pages", 0) > 0:
+            with timing.time_stage(timing.STAGE_RENDER):
+                self.render_streaming(data)
+            return
+
+        with timing.time_stage(timing.STAGE_PLAN):
+            header_layouts = self.plan_headers(data)
+
+        u.log("")
+
+        with timing.time_stage(timing.STAGE_RENDER):
+            self.render(data, header_layouts)
+
+    # Plans the headers as for the PDF, but draws each page to a low resolution image instead (see render_previews)
+    def generate_previews(self, data, preview_dir_path: str):
+        preview_options = get_preview_options(data.config)
+
+        with timing.time_stage(timing.STAGE_PLAN):
+            header_layouts = self.plan_headers(data)
+
+        u.log("")
+
+        with timing.time_stage(timing.STAGE_RENDER):
+            self.render_previews(data, header_layouts, preview_dir_path, preview_options)
+
+    # Draws each planned page, and each of its headers if enabled, to a PNG or WebP image in the preview folder, with Pillow
+    # It's much quicker than rendering the PDF and rasterising it, so it's meant for checking the layout, not for printing
+    # The pages are spread across worker processes, each drawing and saving whole pages
+    def render_previews(self, data, header_layouts: list, preview_dir_path: str, preview_options: dict):
+        pages = get_pages(header_layouts)
+        os.makedirs(preview_dir_path, exist_ok=True)
+
+        workers = data.config.get("workers", 1)
+        if workers > 1 and len(pages) > 1:
+            with get_executor(data, workers) as executor:
+                futures = [executor.submit(render_preview_files, page_headers, self.page_size, preview_dir_path, preview_options) for page_headers in pages]
+                preview_reports = [future.result() for future in futures]
+        else:
+            preview_reports = [render_preview_files(page_headers, self.page_size, preview_dir_path, preview_options) for page_headers in pages]
+
+        preview_file_paths = []
+        for preview_report in preview_reports:
+            timing.add_events(preview_report["timing_events"])
+            preview_file_paths += preview_report["file_paths"]
+
+        # Only keep the previews of the latest run
+        for file_name in os.listdir(preview_dir_path):
+            file_path = os.path.join(preview_dir_path, file_name)
+            if file_name.startswith(PREVIEW_FILENAME_PREFIX) and file_path not in preview_file_paths:
+                os.remove(file_path)
+
+        u.log(f"{len(preview_file_paths)} preview images of {len(pages)} pages written to {preview_dir_path}")
+
+    # Renders the planned headers to the output PDF
+    def render(self, data, header_layouts: list):
+        pages = get_pages(header_layouts)
+
+        workers = data.config.get("workers", 1)
+        if data.config.get("incremental", False):
+            image_stats = self.render_pages_incrementally(data, pages, workers)
+        elif workers > 1 and len(pages) > 1:
+            image_stats = self.render_pages_in_parallel(data, pages, workers)
+        else:
+            image_stats = merge_render_reports([self.render_pages(data, pages, data.output_file_path)])
+
+        u.log_image_report(image_stats, data.output_file_path)
+
+    # Plans and renders the headers a chunk of pages at a time, appending each chunk to the output PDF as soon as it's rendered
+    # The catalog is read, the headers are planned and the images are opened as the pages are reached,
+    # so memory usage depends on the size of a chunk rather than on the size of the catalog
+    def render_streaming(self, data):
+        chunk_pages = data.config["streaming_chunk_pages"]
+        image_stats = {}
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            chunk_file_path = os.path.join(tmp_dir_path, "chunk.pdf")
+            with PdfStreamWriter(data.output_file_path) as pdf_writer:
+                for chunk in iter_chunks(iter_pages(self.iter_header_layouts(data)), chunk_pages):
+                    render_report = self.render_pages(data, chunk, chunk_file_path)
+                    image_stats = u.merge_image_stats([image_stats, merge_render_reports([render_report])])
+                    with timing.time_stage(timing.STAGE_PDF_MERGE):
+                        pdf_writer.append(chunk_file_path)
+
+        u.log("")
+        u.log_image_report(image_stats, data.output_file_path)
+
+    # Returns the layout of every header to draw, in order, without drawing anything
+    def plan_headers(self, data) -> list:
+        return list(self.iter_header_layouts(data))
+
+    # Yields the layout of each header to draw, in order, planning each one only when it's needed
+    def iter_header_layouts(self, data) -> Iterator[HeaderLayout]:
+        for header in self.get_headers(data):
+            yield self.get_header_layout(data, header)
+
+    # Yields the headers to draw, in order
+    # Each header is a dict with at least the "page" it needs to be drawn on
+    def get_headers(self, data) -> Iterator[dict]:
+        raise NotImplementedError
+
+    # Returns the HeaderLayout of the header, with every element positioned on its page
+    def get_header_layout(self, data, header: dict):
+        raise NotImplementedError
+
+    def draw_page(self, c, data, page_headers: list):
+        raise NotImplementedError
+
+    def draw_header(self, c, data, header_layout):
+        image_dpi = u.get_image_dpi(data.config)
+        for element in header_layout.elements:
+            draw_layout_element(c, element, image_dpi)
+
+    # Returns the render report of the pages (see get_render_report)
+    def render_pages(self, data, pages: list, output_file_path: str) -> dict:
+        u.reset_image_stats()
+
+        # Create a new PDF document
+        c = canvas.Canvas(output_file_path, pagesize=self.page_size)
+
+        # Prepare the images of the next headers in the background while drawing each page
+        header_layouts = [header_layout for page_headers in pages for header_layout in page_headers]
+        prefetch_depth = data.config.get("prefetch_depth", 0)
+        with ImagePrefetcher(header_layouts, prefetch_depth, u.get_image_dpi(data.config)) as image_prefetcher:
+            header_index = 0
+            for page_headers in pages:
+                header_index += len(page_headers)
+                image_prefetcher.advance(header_index - 1)
+                self.draw_page(c, data, page_headers)
+
+        # Save and close the PDF document
+        with timing.time_stage(timing.STAGE_PDF_SAVE):
+            c.save()
+
+        return get_render_report()
+
+    # Renders contiguous chunks of pages into partial PDFs in worker processes, then merges them in order
+    def render_pages_in_parallel(self, data, pages: list, workers: int) -> dict:
+        chunk_size = math.ceil(len(pages) / (workers * CHUNKS_PER_WORKER))
+        chunks = [pages[i:i+chunk_size] for i in range(0, len(pages), chunk_size)]
+
+        with tempfile.TemporaryDirectory() as tmp_dir_path:
+            chunk_file_paths = [os.path.join(tmp_dir_path, f"chunk-{i}.pdf") for i in range(0, len(chunks))]
+            with get_executor(data, workers) as executor:
+                futures = [executor.submit(self.render_pages, data, chunk, chunk_file_path) for chunk, chunk_file_path in zip(chunks, chunk_file_paths)]
+                render_reports = [future.result() for future in futures]
+
+            u.merge_pdfs(chunk_file_paths, data.output_file_path)
+
+        return merge_render_reports(render_reports)
+
+    # Reuses the pages rendered by previous builds when none of their inputs changed, and only renders the others
+    # Each page is stored as a single-page PDF keyed by its fingerprint, then all pages are merged in order
+    # Only the images of the rendered pages are counted in the returned stats
+    def render_pages_incrementally(self, data, pages: list, workers: int) -> dict:
+        page_cache_dir_path = data.page_cache_dir_path
+        os.makedirs(page_cache_dir_path, exist_ok=True)
+
+        base_fingerprint = self.get_base_fingerprint(data)
+        page_file_paths = []
+        dirty_pages = {}
+        for page_headers in pages:
+            page_fingerprint = self.get_page_fingerprint(data, page_headers, base_fingerprint)
+            page_file_path = os.path.join(page_cache_dir_path, f"{page_fingerprint}.pdf")
+            page_file_paths.append(page_file_path)
+            if not os.path.exists(page_file_path):
+                dirty_pages[page_file_path] = page_headers
+
+        u.log(f"Rendering {len(dirty_pages)} of {len(pages)} pages, the others didn't change since the last build")
+
+        if workers > 1 and len(dirty_pages) > 1:
+            with get_executor(data, workers) as executor:
+                futures = [executor.submit(self.render_page_file, data, page_headers, page_file_path) for page_file_path, page_headers in dirty_pages.items()]
+                render_reports = [future.result() for future in futures]
+        else:
+            render_reports = [self.render_page_file(data, page_headers, page_file_path) for page_file_path, page_headers in dirty_pages.items()]
+
+        u.merge_pdfs(page_file_paths, data.output_file_path)
+
+        # Only keep the pages of the latest build
+        for file_name in os.listdir(page_cache_dir_path):
+            file_path = os.path.join(page_cache_dir_path, file_name)
+            if file_path not in page_file_paths:
+                os.remove(file_path)
+
+        return merge_render_reports(render_reports)
+
+    def render_page_file(self, data, page_headers: list, page_file_path: str) -> dict:
+        # Write to a temporary file first, so a page is never seen half-written
+        tmp_page_file_path = f"{page_file_path}.{os.getpid()}.tmp"
+        render_report = self.render_pages(data, [page_headers], tmp_page_file_path)
+        os.replace(tmp_page_file_path, page_file_path)
+        return render_report
+
+    # The inputs shared by all pages: the generator code, fonts, frame images and layout options
+    def get_base_fingerprint(self, data) -> dict:
+        return {
+            "generator": type(self).__name__,
+            "code": get_code_hash(),
+            "shared_files": [get_optional_file_hash(file_path) for file_path in u.get_shared_file_paths()],
+            "config": {key: value for key, value in data.config.items() if key not in NON_RENDERING_CONFIG_KEYS}
+        }
+
+    # The page number is left out, so a page that only moved (e.g. when a set is added before it) is reused
+    # The paths of the images are left out too, as their content is fingerprinted instead,
+    # so a page has the same fingerprint wherever the repository is (e.g. on each machine generating the shards of a PDF)
+    def get_page_fingerprint(self, data, page_headers: list, base_fingerprint: dict) -> str:
+        headers_fingerprint = []
+        for header_layout in page_headers:
+            header_fingerprint = header_layout.to_dict()
+            del header_fingerprint["page"]
+            for element_fingerprint in header_fingerprint["elements"]:
+                element_fingerprint.pop("path", None)
+            header_fingerprint["files"] = [get_optional_file_hash(file_path) for file_path in header_layout.get_file_paths()]
+            headers_fingerprint.append(header_fingerprint)
+
+        fingerprint = dict(base_fingerprint, headers=headers_fingerprint)
+        fingerprint_data = json.dumps(fingerprint, sort_keys=True)
+        return hashlib.sha256(fingerprint_data.encode("utf-8")).hexdigest()
+
+    # Fingerprint of the inputs of every page, in order, so it changes whenever any page of the PDF would
+    def get_pdf_fingerprint(self, data, header_layouts: list) -> str:
+        base_fingerprint = self.get_base_fingerprint(data)
+        page_fingerprints = [self.get_page_fingerprint(data, page_headers, base_fingerprint) for page_headers in get_pages(header_layouts)]
+        return hashlib.sha256("|".join(page_fingerprints).encode("utf-8")).hexdigest()
+
+
+# Groups the header layouts by page, in order
+def get_pages(header_layouts: list) -> list:
+    return list(iter_pages(header_layouts))
+
+
+# Groups the header layouts by page as they come, yielding each page once all its headers are known
+def iter_pages(header_layouts: Iterable[HeaderLayout]) -> Iterator[list]:
+    page_headers = []
+    for header_layout in header_layouts:
+        if page_headers and page_headers[0].page != header_layout.page:
+            yield page_headers
+            page_headers = []
+        page_headers.append(header_layout)
+    if page_headers:
+        yield page_headers
+
+
+# Groups the pages into chunks of at most chunk_pages pages, as they come
+def iter_chunks(pages: Iterable[list], chunk_pages: int) -> Iterator[list]:
+    chunk = []
+    for page_headers in pages:
+        chunk.append(page_headers)
+        if len(chunk) == chunk_pages:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def draw_layout_element(c, element, image_dpi: float):
+    if isinstance(element, ImageLayout):
+        u.draw_image(element.path, element.x, element.y, c, width=element.width, height=element.height, h_align=element.h_align, v_align=element.v_align, crop_to_cover=element.crop_to_cover, border_width=element.border_width, dpi=image_dpi)
+    elif isinstance(element, FrameLayout):
+        u.draw_frame(element.x, element.y, c, width=element.width, height=element.height, border_thickness=element.border_thickness, h_align=element.h_align, v_align=element.v_align, is_full_size=element.is_full_size)
+    elif isinstance(element, TextLayout):
+        u.write_text(element.text, element.x, element.y, c, font_weight=element.font_weight, font_size=element.font_size, h_align=element.h_align, v_align=element.v_align)
+    elif isinstance(element, LineLayout):
+        c.line(element.x1, element.y1, element.x2, element.y2)
+
+
+# Draws and saves the previews of a page, returning the paths of the saved images and the timed stages,
+# so that they can be passed back from a worker process
+def render_preview_files(page_headers: list, page_size: tuple, preview_dir_path: str, preview_options: dict) -> dict:
+    return {
+        "file_paths": render_page_previews(page_headers, page_size, preview_dir_path, preview_options),
+        "timing_events": timing.collect_events()
+    }
+
+
+# What rendering some pages returns, so that it can be passed back from a worker process:
+# the stats of the embedded images and the timed stages
+def get_render_report() -> dict:
+    return {
+        "image_stats": u.reset_image_stats(),
+        "timing_events": timing.collect_events()
+    }
+
+
+# Adds the timed stages of the renders to the ones of this process, and returns the image stats of all the renders
+def merge_render_reports(render_reports: list) -> dict:
+    for render_report in render_reports:
+        timing.add_events(render_report["timing_events"])
+    return u.merge_image_stats([render_report["image_stats"] for render_report in render_reports])
+
+
+def get_executor(data, workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(data, u.asset_cache, timing.enabled))
+
+
+# Hash of the source code of the scripts, so that changing how headers are drawn invalidates the rendered pages
+def get_code_hash() -> str:
+    scripts_dir_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code_hash = hashlib.sha256()
+    for dir_path, _, file_names in sorted(os.walk(scripts_dir_path)):
+        for file_name in sorted(file_names):
+            if file_name.endswith(".py"):
+                code_hash.update(get_file_hash(os.path.join(dir_path, file_name)).encode("utf-8"))
+    return code_hash.hexdigest()
+
+
+def get_optional_file_hash(file_path: str) -> str:
+    if not os.path.exists(file_path):
+        return None
+    return get_file_hash(file_path)
+
+
+# Worker processes may not share the state of the main process (e.g. when spawned), so the utils module is set up again
+def init_worker(data, asset_cache, timing_enabled: bool):
+    u.init(data.fonts_dir_path, data.frame_imgs_dir_path, os.path.join(data.cache_dir_path, "fonts"))
+    u.set_font_selection(data.config.get("font_selection", u.FONT_SELECTION_RANGES))
+    u.set_jpeg_quality(data.config.get("jpeg_quality", u.DEFAULT_JPEG_QUALITY))
+    u.set_asset_cache(asset_cache)
+    if timing_enabled:
+        timing.enable()
@@ -0,0 +1,269 @@
+import io
+import os
+import json
+import time
+import shutil
+import contextlib
+from functools import reduce
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageChops
+
+try:
+    import pymupdf
+except ImportError:
+    # In the requirements, the runs whose goldens have PDF pages fail without it
+    pymupdf = None
+
+import scripts.utils as u
+from scripts.batch import GENERATORS
+from scripts.benchmark import BenchmarkPaths, get_generator_data
+from scripts.layout import TextLayout
+from scripts.asset_cache import get_file_hash
+from scripts.preview_renderer import PREVIEW_FORMAT_PNG, PREVIEW_FILENAME_PREFIX
+
+# The generator and layout options of each golden run
+GOLDEN_RUNS = [
+    {"headers_type": "cards", "cards_alignment": "spaced", "print_markers": False},
+    {"headers_type": "cards", "cards_alignment": "spaced", "print_markers": True},
+    {"headers_type": "cards", "cards_alignment": "packed", "print_markers": False},
+    {"headers_type": "cards", "cards_alignment": "packed", "print_markers": True},
+    {"headers_type": "pages", "print_markers": False}
+]
+
+# The config values that change how the pages look are pinned, so the goldens don't change with the defaults of config_template.yaml
+GOLDEN_CONFIG = {
+    "print_dpi": 30,
+    "draft": False,
+    "jpeg_quality": 90,
+    "font_selection": u.FONT_SELECTION_RANGES,
+    "workers": 1,
+    "incremental": False,
+    "asset_cache_max_size_mb": 0,
+    "streaming_chunk_pages": 0
+}
+
+# The resolution the pages are rasterised at, kept low so the goldens stay small
+GOLDEN_RASTER_DPI = 24
+
+# How far apart a position or size (in points) of the current and golden layouts can be
+LAYOUT_TOLERANCE = 0.01
+# How far apart a channel of a pixel of the current and golden images can be (out of 255), e.g. from anti-aliasing,
+# and the ratio of the pixels of an image allowed to be further apart than that
+PIXEL_TOLERANCE = 24
+MAX_DIFFERENT_PIXELS_RATIO = 0.002
+
+MAX_LOGGED_DIFFERENCES = 5
+
+LAYOUT_FILE_NAME = "layout.json"
+FONTS_FILE_NAME = "fonts.json"
+PDF_PAGE_FILENAME_PREFIX = "pdf-"
+
+
+# The name of the run, also the name of its goldens folder, e.g. "cards-packed-markers"
+def get_run_name(run_options: dict) -> str:
+    run_name = run_options["headers_type"]
+    if run_options["headers_type"] == "cards":
+        run_name += f"-{run_options['cards_alignment']}"
+    if run_options.get("print_markers"):
+        run_name += "-markers"
+    return run_name
+
+
+# Renders the fixture catalog in every mode, each in a new process, and compares the results with the goldens (or replaces them)
+# Returns the results of the runs, each with its timed stages and the differences found
+def run_golden_checks(work_dir_path: str, goldens_dir_path: str, catalog_file_path: str, assets_dir_path: str, base_config: dict, run_names: list, update: bool) -> list:
+    if not pymupdf:
+        u.log("pymupdf isn't installed, so the PDF pages can't be rasterised and compared, install it with \"pip install -r requirements.txt\"")
+
+    results = []
+    for run_options in GOLDEN_RUNS:
+        run_name = get_run_name(run_options)
+        if run_names and run_name not in run_names:
+            continue
+
+        paths = BenchmarkPaths(work_dir_path, catalog_file_path, assets_dir_path, run_name)
+        images_dir_path = os.path.join(work_dir_path, "images", run_name)
+        config = dict(base_config, **GOLDEN_CONFIG, **run_options)
+
+        # A new process per run, so fonts and caches start from scratch and the timings are comparable
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            run_result = executor.submit(run_golden, paths, config, images_dir_path).result()
+
+        golden_dir_path = os.path.join(goldens_dir_path, run_name)
+        if update:
+            update_goldens(images_dir_path, golden_dir_path)
+            differences = []
+        else:
+            differences = get_differences(images_dir_path, golden_dir_path)
+
+        stages_text = ", ".join([f"{stage} {stage_time:.2f} s" for stage, stage_time in run_result["stages_s"].items()])
+        status = "UPDATED" if update else ("OK" if not differences else "DIFFERENT")
+        u.log(f"{run_name}: {status} ({stages_text})")
+        for difference in differences[:MAX_LOGGED_DIFFERENCES]:
+            u.log(difference, 1)
+        if len(differences) > MAX_LOGGED_DIFFERENCES:
+            u.log(f"and {len(differences) - MAX_LOGGED_DIFFERENCES} more differences", 1)
+
+        results.append(dict(run_options, name=run_name, differences=differences, **run_result))
+
+    return results
+
+
+# Plans and renders the run as generate.py does, timing each stage, then writes its layout and page images to the images folder
+def run_golden(paths: BenchmarkPaths, config: dict, images_dir_path: str) -> dict:
+    shutil.rmtree(paths.cache_dir_path, ignore_errors=True)
+    shutil.rmtree(images_dir_path, ignore_errors=True)
+    os.makedirs(paths.cache_dir_path)
+    os.makedirs(images_dir_path)
+    os.makedirs(os.path.dirname(paths.output_file_path), exist_ok=True)
+
+    stages = {}
+    # The generators log every set, which isn't needed here
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = get_generator_data(paths, config)
+        generator = GENERATORS[config["headers_type"]]()
+
+        stage_start_time = time.perf_counter()
+        header_layouts = generator.plan_headers(data)
+        stages["plan"] = time.perf_counter() - stage_start_time
+
+        stage_start_time = time.perf_counter()
+        generator.render(data, header_layouts)
+        stages["render"] = time.perf_counter() - stage_start_time
+
+        stage_start_time = time.perf_counter()
+        generator.render_previews(data, header_layouts, images_dir_path, {"dpi": GOLDEN_RASTER_DPI, "format": PREVIEW_FORMAT_PNG, "headers": False})
+        stages["preview"] = time.perf_counter() - stage_start_time
+
+    # The asset paths are made relative, so the goldens don't depend on where the repository is
+    repo_dir_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    layout = [add_font_names(get_relative_paths(header_layout.to_dict(), repo_dir_path)) for header_layout in header_layouts]
+    with open(os.path.join(images_dir_path, LAYOUT_FILE_NAME), "w", encoding="utf-8") as f:
+        json.dump(layout, f, indent=1, ensure_ascii=False)
+
+    # The Japanese fonts aren't in the repository, so the pages only look the same when rendered with the same font files
+    font_hashes = {os.path.relpath(u.font_paths[font_name], repo_dir_path).replace(os.sep, "/"): get_file_hash(u.font_paths[font_name]) for font_name in u.registered_font_names}
+    with open(os.path.join(images_dir_path, FONTS_FILE_NAME), "w", encoding="utf-8") as f:
+        json.dump(font_hashes, f, indent=1, sort_keys=True)
+
+    if pymupdf:
+        rasterise_pdf(paths.output_file_path, images_dir_path)
+
+    return {
+        "stages_s": {stage: round(stage_time, 3) for stage, stage_time in stages.items()},
+        "headers": len(header_layouts),
+        "pages": len(set([header_layout.page for header_layout in header_layouts]))
+    }
+
+
+# Adds the font each text is written with, so the choice between the English and Japanese fonts is checked too
+def add_font_names(header_layout: dict) -> dict:
+    for element in header_layout["elements"]:
+        if element["type"] == TextLayout.__name__ and element["text"]:
+            element["font_name"] = u.get_font_name(element["text"], element["font_weight"])
+    return header_layout
+
+
+def get_relative_paths(value, base_dir_path: str):
+    if isinstance(value, dict):
+        return {key: get_relative_paths(item, base_dir_path) if key != "path" else os.path.relpath(item, base_dir_path).replace(os.sep, "/") for key, item in value.items()}
+    if isinstance(value, list):
+        return [get_relative_paths(item, base_dir_path) for item in value]
+    return value
+
+
+# Whether the PDF pages can be rasterised, to compare them with the goldens
+def can_rasterise_pdf() -> bool:
+    return pymupdf is not None
+
+
+def rasterise_pdf(pdf_file_path: str, images_dir_path: str):
+    with pymupdf.open(pdf_file_path) as document:
+        for page_index, page in enumerate(document):
+            page.get_pixmap(dpi=GOLDEN_RASTER_DPI).save(os.path.join(images_dir_path, f"{PDF_PAGE_FILENAME_PREFIX}{page_index + 1:04d}.png"))
+
+
+# Replaces the goldens of the run with its layout and page images
+def update_goldens(images_dir_path: str, golden_dir_path: str):
+    shutil.rmtree(golden_dir_path, ignore_errors=True)
+    shutil.copytree(images_dir_path, golden_dir_path)
+
+
+# Returns a description of every difference between the layout and page images of the run and its goldens
+def get_differences(images_dir_path: str, golden_dir_path: str) -> list:
+    if not os.path.isdir(golden_dir_path):
+        return [f"No goldens at {golden_dir_path}, run with --update to write them"]
+
+    differences = []
+    golden_layout = u.parse_json(os.path.join(golden_dir_path, LAYOUT_FILE_NAME))
+    layout = u.parse_json(os.path.join(images_dir_path, LAYOUT_FILE_NAME))
+    add_layout_differences(golden_layout, layout, "headers", differences)
+
+    golden_font_hashes = u.parse_json(os.path.join(golden_dir_path, FONTS_FILE_NAME))
+    font_hashes = u.parse_json(os.path.join(images_dir_path, FONTS_FILE_NAME))
+    for font_path in sorted(set(golden_font_hashes) | set(font_hashes)):
+        if font_path not in font_hashes:
+            differences.append(f"{font_path}: not used, the goldens were rendered with it")
+        elif font_path not in golden_font_hashes:
+            differences.append(f"{font_path}: used, the goldens were rendered without it")
+        elif font_hashes[font_path] != golden_font_hashes[font_path]:
+            differences.append(f"{font_path}: not the font file the goldens were rendered with, so the pages can't match")
+
+    image_file_names = set([file_name for file_name in os.listdir(images_dir_path) if file_name.endswith(".png")])
+    golden_image_file_names = set([file_name for file_name in os.listdir(golden_dir_path) if file_name.endswith(".png")])
+    has_golden_pdf_pages = any([file_name.startswith(PDF_PAGE_FILENAME_PREFIX) for file_name in golden_image_file_names])
+    if has_golden_pdf_pages and not pymupdf:
+        differences.append(f"{PDF_PAGE_FILENAME_PREFIX}*.png: the PDF pages can't be compared, pymupdf isn't installed")
+    for file_name in sorted(golden_image_file_names | image_file_names):
+        # The PDF pages are only compared when the goldens have them, and without pymupdf the run already has a difference for them
+        if file_name.startswith(PDF_PAGE_FILENAME_PREFIX) and not (pymupdf and has_golden_pdf_pages):
+            continue
+        if file_name not in image_file_names:
+            differences.append(f"{file_name}: missing, the golden has more pages")
+        elif file_name not in golden_image_file_names:
+            differences.append(f"{file_name}: new, the golden has fewer pages")
+        else:
+            image_difference = get_image_difference(os.path.join(golden_dir_path, file_name), os.path.join(images_dir_path, file_name))
+            if image_difference:
+                differences.append(f"{file_name}: {image_difference}")
+
+    return differences
+
+
+# Compares the layouts value by value, allowing numbers to be LAYOUT_TOLERANCE apart
+def add_layout_differences(golden_value, value, value_path: str, differences: list):
+    if isinstance(golden_value, dict) and isinstance(value, dict):
+        for key in sorted(set(golden_value) | set(value)):
+            add_layout_differences(golden_value.get(key), value.get(key), f"{value_path}.{key}", differences)
+    elif isinstance(golden_value, list) and isinstance(value, list):
+        if len(golden_value) != len(value):
+            differences.append(f"{value_path}: {len(value)} items instead of {len(golden_value)}")
+        for index, (golden_item, item) in enumerate(zip(golden_value, value)):
+            add_layout_differences(golden_item, item, f"{value_path}[{index}]", differences)
+    elif is_number(golden_value) and is_number(value):
+        if abs(golden_value - value) > LAYOUT_TOLERANCE:
+            differences.append(f"{value_path}: {value!r} instead of {golden_value!r}")
+    elif golden_value != value:
+        differences.append(f"{value_path}: {value!r} instead of {golden_value!r}")
+
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+# Returns why the image is too different from the golden image, or None if it's within the tolerance
+def get_image_difference(golden_image_path: str, image_path: str) -> str:
+    with Image.open(golden_image_path) as golden_image, Image.open(image_path) as image:
+        if golden_image.size != image.size:
+            return f"{image.size[0]}x{image.size[1]} pixels instead of {golden_image.size[0]}x{golden_image.size[1]}"
+        difference = ImageChops.difference(golden_image.convert("RGB"), image.convert("RGB"))
+
+    # How far apart each pixel is, on its most different channel
+    pixel_difference = reduce(ImageChops.lighter, difference.split())
+    different_pixels = sum(pixel_difference.histogram()[PIXEL_TOLERANCE + 1:])
+    different_pixels_ratio = different_pixels / (pixel_difference.width * pixel_difference.height)
+    if different_pixels_ratio <= MAX_DIFFERENT_PIXELS_RATIO:
+        return None
+    _, max_difference = pixel_difference.getextrema()
+    return f"{different_pixels_ratio:.2%} of the pixels are different, by up to {max_difference}"
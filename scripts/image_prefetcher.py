@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import scripts.utils as u
+from scripts.layout import ImageLayout
+
+# How many images are opened and processed at the same time
+# Decoding, resizing and encoding release the GIL, as does reading the files, so threads are enough
+PREFETCH_THREADS = 4
+
+
+# Opens and processes the images of the next headers in background threads, while the current header is drawn
+# At most prefetch_depth headers ahead are prepared, so only their images are kept in memory
+# draw_image picks up the prepared images from u.prefetched_images, and prepares the others itself
+class ImagePrefetcher():
+    def __init__(self, header_layouts: list, prefetch_depth: int, dpi: float):
+        self.header_layouts = header_layouts
+        self.prefetch_depth = prefetch_depth
+        self.dpi = dpi
+        self.next_header_index = 0
+        self.prefetch_keys = set()
+        self.executor = None
+        if prefetch_depth > 0:
+            self.executor = ThreadPoolExecutor(max_workers=PREFETCH_THREADS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Called before drawing the headers up to header_index, to also start preparing the prefetch_depth headers after them
+    def advance(self, header_index: int):
+        if not self.executor:
+            return
+
+        last_header_index = min(header_index + self.prefetch_depth, len(self.header_layouts) - 1)
+        while self.next_header_index <= last_header_index:
+            self.prefetch_header(self.header_layouts[self.next_header_index])
+            self.next_header_index += 1
+
+    def prefetch_header(self, header_layout):
+        for element in header_layout.elements:
+            if not isinstance(element, ImageLayout):
+                continue
+
+            # An image drawn more than once is only prepared for its first use, as it's then reused from the document
+            prefetch_key = u.get_prefetch_key(element.path, element.width, element.height, element.crop_to_cover, self.dpi)
+            if prefetch_key in self.prefetch_keys:
+                continue
+            self.prefetch_keys.add(prefetch_key)
+            u.prefetched_images[prefetch_key] = self.executor.submit(u.prepare_image, element.path, element.width, element.height, element.crop_to_cover, self.dpi)
+
+    def close(self):
+        if not self.executor:
+            return
+
+        # Drop the images that were prepared but never drawn (e.g. when rendering failed)
+        for prefetch_key in self.prefetch_keys:
+            prefetched_image = u.prefetched_images.pop(prefetch_key, None)
+            if prefetched_image:
+                prefetched_image.cancel()
+        self.executor.shutdown(wait=True)
+        self.executor = None
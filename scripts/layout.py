@@ -0,0 +1,62 @@
+# The layout records of the headers, planned by the generators before anything is drawn
+# They only hold plain values (positions, sizes, fitted font sizes and resolved asset paths), so planning doesn't need a canvas,
+# and they are small enough to be kept for the whole catalog, fingerprinted and sent to worker processes
+
+
+# The base class of the layout records
+class LayoutRecord():
+    __slots__ = ()
+
+    def __init__(self, *values, **named_values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+        for name, value in named_values.items():
+            setattr(self, name, value)
+
+    def __repr__(self) -> str:
+        values = ", ".join([f"{name}={getattr(self, name)!r}" for name in self.__slots__])
+        return f"{type(self).__name__}({values})"
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    # Returns the record as plain values (e.g. to fingerprint it), including the type of record
+    def to_dict(self) -> dict:
+        record_dict = {"type": type(self).__name__}
+        for name in self.__slots__:
+            record_dict[name] = to_plain_value(getattr(self, name))
+        return record_dict
+
+
+class TextLayout(LayoutRecord):
+    __slots__ = ("text", "x", "y", "font_weight", "font_size", "h_align", "v_align")
+
+
+class LineLayout(LayoutRecord):
+    __slots__ = ("x1", "y1", "x2", "y2")
+
+
+class ImageLayout(LayoutRecord):
+    __slots__ = ("path", "x", "y", "width", "height", "h_align", "v_align", "crop_to_cover", "border_width")
+
+
+class FrameLayout(LayoutRecord):
+    __slots__ = ("x", "y", "width", "height", "border_thickness", "h_align", "v_align", "is_full_size")
+
+
+# A header to draw on a page, in the given slot of that page
+# Its elements are drawn in order, so later elements are drawn on top of earlier ones
+class HeaderLayout(LayoutRecord):
+    __slots__ = ("page", "slot", "elements")
+
+    # Returns the paths of the images drawn in the header
+    def get_file_paths(self) -> list:
+        return [element.path for element in self.elements if isinstance(element, ImageLayout)]
+
+
+def to_plain_value(value):
+    if isinstance(value, LayoutRecord):
+        return value.to_dict()
+    if isinstance(value, (list, tuple)):
+        return [to_plain_value(item) for item in value]
+    return value
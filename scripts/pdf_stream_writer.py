@@ -0,0 +1,122 @@
+from pypdf import PdfReader
+from pypdf.generic import DictionaryObject, ArrayObject, IndirectObject, NameObject, NumberObject
+
+PDF_HEADER = b"%PDF-1.4\n%\x93\x8c\x8b\x9e\n"
+
+# The objects written last, once every page is known, but numbered first
+CATALOG_OBJECT_NUMBER = 1
+PAGES_OBJECT_NUMBER = 2
+FIRST_OBJECT_NUMBER = 3
+
+
+# Writes the pages of multiple PDFs into a single PDF, one input PDF at a time
+# The objects of each input PDF are copied as they are (without decoding their streams) and written to the output straight away,
+# so only the input PDF being appended is held in memory, however many pages the output has
+class PdfStreamWriter():
+    def __init__(self, output_file_path: str):
+        self.output_file_path = output_file_path
+        self.file = None
+        self.object_offsets = {}
+        self.next_object_number = FIRST_OBJECT_NUMBER
+        self.page_object_numbers = []
+        self.info_object_number = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self.file:
+            self.file.close()
+
+    def open(self):
+        self.file = open(self.output_file_path, "wb")
+        self.file.write(PDF_HEADER)
+
+    # Appends every page of the PDF, with everything they reference (contents, fonts, images, forms)
+    def append(self, pdf_file_path: str):
+        reader = PdfReader(pdf_file_path)
+        # The number in the output of each object of the input, and the objects to write
+        object_numbers = {}
+        pending_references = []
+
+        def get_object_number(reference: IndirectObject) -> int:
+            reference_key = (reference.idnum, reference.generation)
+            if reference_key not in object_numbers:
+                object_numbers[reference_key] = self.next_object_number
+                self.next_object_number += 1
+                pending_references.append(reference)
+            return object_numbers[reference_key]
+
+        # The document info (producer, creation date, ...) is taken from the first PDF
+        if self.info_object_number is None and isinstance(reader.trailer.get("/Info"), IndirectObject):
+            self.info_object_number = get_object_number(reader.trailer.raw_get("/Info"))
+
+        for page in reader.pages:
+            self.page_object_numbers.append(get_object_number(page.indirect_reference))
+
+        while pending_references:
+            reference = pending_references.pop()
+            pdf_object = reader.get_object(reference)
+            if isinstance(pdf_object, DictionaryObject) and pdf_object.get("/Type") == "/Page":
+                # The inherited attributes were already copied to the page by the reader, so the parent can be replaced
+                pdf_object[NameObject("/Parent")] = IndirectObject(PAGES_OBJECT_NUMBER, 0, None)
+            renumber_references(pdf_object, get_object_number)
+            self.write_object(object_numbers[(reference.idnum, reference.generation)], pdf_object)
+
+    def write_object(self, object_number: int, pdf_object):
+        self.object_offsets[object_number] = self.file.tell()
+        self.file.write(f"{object_number} 0 obj\n".encode("ascii"))
+        pdf_object.write_to_stream(self.file)
+        self.file.write(b"\nendobj\n")
+
+    # Writes the page tree, the catalog and the cross-reference table, and closes the file
+    def close(self):
+        pages = DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject([IndirectObject(object_number, 0, None) for object_number in self.page_object_numbers]),
+            NameObject("/Count"): NumberObject(len(self.page_object_numbers))
+        })
+        self.write_object(PAGES_OBJECT_NUMBER, pages)
+        catalog = DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): IndirectObject(PAGES_OBJECT_NUMBER, 0, None)
+        })
+        self.write_object(CATALOG_OBJECT_NUMBER, catalog)
+
+        xref_offset = self.file.tell()
+        self.file.write(f"xref\n0 {self.next_object_number}\n".encode("ascii"))
+        self.file.write(b"0000000000 65535 f \n")
+        for object_number in range(1, self.next_object_number):
+            self.file.write(f"{self.object_offsets[object_number]:010d} 00000 n \n".encode("ascii"))
+
+        trailer = DictionaryObject({
+            NameObject("/Size"): NumberObject(self.next_object_number),
+            NameObject("/Root"): IndirectObject(CATALOG_OBJECT_NUMBER, 0, None)
+        })
+        if self.info_object_number is not None:
+            trailer[NameObject("/Info")] = IndirectObject(self.info_object_number, 0, None)
+        self.file.write(b"trailer\n")
+        trailer.write_to_stream(self.file)
+        self.file.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode("ascii"))
+        self.file.close()
+        self.file = None
+
+
+# Replaces, in place, the references to objects of the input PDF with references to their numbers in the output
+def renumber_references(pdf_object, get_object_number):
+    if isinstance(pdf_object, DictionaryObject):
+        for key, value in list(dict.items(pdf_object)):
+            dict.__setitem__(pdf_object, key, get_renumbered_value(value, get_object_number))
+    elif isinstance(pdf_object, ArrayObject):
+        for index, value in enumerate(list.__iter__(pdf_object)):
+            list.__setitem__(pdf_object, index, get_renumbered_value(value, get_object_number))
+
+
+def get_renumbered_value(value, get_object_number):
+    if isinstance(value, IndirectObject):
+        return IndirectObject(get_object_number(value), 0, None)
+    renumber_references(value, get_object_number)
+    return value
@@ -0,0 +1,200 @@
+import os
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont, features
+from reportlab.lib.units import inch
+
+import scripts.utils as u
+import scripts.timing as timing
+from scripts.layout import TextLayout, LineLayout, ImageLayout, FrameLayout
+
+PREVIEW_FORMAT_PNG = "png"
+PREVIEW_FORMAT_WEBP = "webp"
+
+DEFAULT_PREVIEW_DPI = 36
+DEFAULT_PREVIEW_FORMAT = PREVIEW_FORMAT_PNG
+# Previews are written far more often than they're kept, so the images are compressed quickly rather than tightly
+PREVIEW_WEBP_QUALITY = 80
+PREVIEW_WEBP_METHOD = 2
+PREVIEW_PNG_COMPRESS_LEVEL = 1
+
+PREVIEW_FILENAME_PREFIX = "page-"
+
+PAGE_COLOUR = (255, 255, 255)
+INK_COLOUR = (0, 0, 0)
+
+# The line width reportlab draws with by default, in points
+DEFAULT_LINE_WIDTH = 1
+
+
+# Reads and checks the preview values of the config
+def get_preview_options(config: dict) -> dict:
+    preview_format = config.get("preview_format", DEFAULT_PREVIEW_FORMAT)
+    if preview_format not in [PREVIEW_FORMAT_PNG, PREVIEW_FORMAT_WEBP]:
+        raise u.ConfigError(f"Unknown preview_format value \"{preview_format}\"")
+    if preview_format == PREVIEW_FORMAT_WEBP and not features.check("webp"):
+        raise u.ConfigError("This Pillow build can't write WebP images, use the png preview_format instead")
+
+    return {
+        "dpi": config.get("preview_dpi", DEFAULT_PREVIEW_DPI),
+        "format": preview_format,
+        "headers": config.get("preview_headers", False)
+    }
+
+
+# Draws the page with Pillow and saves it to the preview folder, along with an image of each of its headers if enabled
+# Returns the paths of the saved images
+def render_page_previews(page_headers: list, page_size: tuple, preview_dir_path: str, preview_options: dict) -> list:
+    page_preview = PagePreview(page_size, preview_options["dpi"])
+    header_boxes = [page_preview.draw_header(header_layout) for header_layout in page_headers]
+
+    page = page_headers[0].page
+    preview_format = preview_options["format"]
+    preview_file_path = os.path.join(preview_dir_path, f"{PREVIEW_FILENAME_PREFIX}{page:04d}.{preview_format}")
+    preview_file_paths = [preview_file_path]
+    with timing.time_stage(timing.STAGE_PREVIEW_SAVE):
+        save_preview(page_preview.image, preview_file_path, preview_format)
+        if preview_options["headers"]:
+            for header_layout, header_box in zip(page_headers, header_boxes):
+                if not header_box:
+                    continue
+                header_file_path = os.path.join(preview_dir_path, f"{PREVIEW_FILENAME_PREFIX}{page:04d}-{header_layout.slot}.{preview_format}")
+                save_preview(page_preview.image.crop(header_box), header_file_path, preview_format)
+                preview_file_paths.append(header_file_path)
+
+    return preview_file_paths
+
+
+def save_preview(image: Image, file_path: str, preview_format: str):
+    if preview_format == PREVIEW_FORMAT_WEBP:
+        image.save(file_path, format="webp", quality=PREVIEW_WEBP_QUALITY, method=PREVIEW_WEBP_METHOD)
+    else:
+        image.save(file_path, format="png", compress_level=PREVIEW_PNG_COMPRESS_LEVEL)
+
+
+# A page drawn with Pillow at a low resolution, from the same layout records as the PDF
+# Positions and sizes are in points from the bottom-left of the page, as on the PDF canvas, and converted to pixels when drawn
+class PagePreview():
+    def __init__(self, page_size: tuple, dpi: float):
+        page_width, page_height = page_size
+        self.dpi = dpi
+        self.scale = dpi / inch
+        self.page_height = page_height
+        self.image = Image.new("RGB", (round(page_width * self.scale), round(page_height * self.scale)), PAGE_COLOUR)
+        self.draw = ImageDraw.Draw(self.image)
+
+    # Draws the elements of the header in order, and returns the pixel box (left, top, right, bottom) they cover on the page
+    def draw_header(self, header_layout) -> tuple:
+        header_box = None
+        for element in header_layout.elements:
+            element_box = self.draw_element(element)
+            if element_box and header_box:
+                header_box = (min(header_box[0], element_box[0]), min(header_box[1], element_box[1]), max(header_box[2], element_box[2]), max(header_box[3], element_box[3]))
+            elif element_box:
+                header_box = element_box
+
+        if not header_box:
+            return None
+        # Only keep what's within the page
+        left, top, right, bottom = header_box
+        page_w, page_h = self.image.size
+        return (max(0, left), max(0, top), min(page_w, right), min(page_h, bottom))
+
+    def draw_element(self, element) -> tuple:
+        if isinstance(element, ImageLayout):
+            return self.draw_image(element)
+        elif isinstance(element, FrameLayout):
+            return self.draw_frame(element)
+        elif isinstance(element, TextLayout):
+            return self.write_text(element)
+        elif isinstance(element, LineLayout):
+            return self.draw_line(element)
+        return None
+
+    def draw_image(self, element: ImageLayout) -> tuple:
+        with Image.open(element.path) as image:
+            image_w, image_h, transform = u.get_image_placement(image.size, element.width, element.height, element.crop_to_cover, self.dpi)
+            box_ratio, pixel_size, _ = transform
+            x, y = u.get_aligned_origin(element.x, element.y, image_w, image_h, element.h_align, element.v_align)
+            image_box = self.get_pixel_box(x, y, image_w, image_h)
+            if u.asset_cache:
+                # The processed image is kept in the assets cache, as for the PDF, so the next previews at the same DPI reuse it
+                with Image.open(u.get_image_source(element.path, image, transform)) as processed_image:
+                    self.paste_image(processed_image, image_box)
+            else:
+                self.paste_image(u.process_image(image, pixel_size, box_ratio), image_box)
+
+        if element.border_width > 0:
+            self.draw.rectangle(get_inclusive_box(image_box), outline=INK_COLOUR, width=self.get_pixel_width(element.border_width))
+        return image_box
+
+    def draw_frame(self, element: FrameLayout) -> tuple:
+        x, y, width, height = u.get_frame_placement(element.x, element.y, element.width, element.height, element.border_thickness, element.h_align, element.v_align, element.is_full_size)
+        for image_path, part_x, part_y, part_w, part_h in u.get_frame_parts(x, y, width, height, element.border_thickness):
+            part_box = self.get_pixel_box(part_x, part_y, part_w, part_h)
+            self.paste_image(get_frame_part_image(image_path, part_box[2] - part_box[0], part_box[3] - part_box[1]), part_box)
+        return self.get_pixel_box(x, y, width + 2*element.border_thickness, height + 2*element.border_thickness)
+
+    def write_text(self, element: TextLayout) -> tuple:
+        if not element.text:
+            return None
+
+        font_path = u.font_paths[u.get_font_name(element.text, element.font_weight)]
+        text_width = u.get_text_width(element.text, element.font_weight, element.font_size)
+        # The origin is on the baseline of the text, as with drawString
+        x, y = u.get_aligned_origin(element.x, element.y, text_width, element.font_size, element.h_align, element.v_align)
+        font = get_font(font_path, round(element.font_size * self.scale, 1))
+        self.draw.text(self.get_pixel_point(x, y), element.text, font=font, fill=INK_COLOUR, anchor="ls")
+        return self.get_pixel_box(x, y, text_width, element.font_size)
+
+    def draw_line(self, element: LineLayout) -> tuple:
+        point_1 = self.get_pixel_point(element.x1, element.y1)
+        point_2 = self.get_pixel_point(element.x2, element.y2)
+        self.draw.line([point_1, point_2], fill=INK_COLOUR, width=self.get_pixel_width(DEFAULT_LINE_WIDTH))
+        return (min(point_1[0], point_2[0]), min(point_1[1], point_2[1]), max(point_1[0], point_2[0]) + 1, max(point_1[1], point_2[1]) + 1)
+
+    # Resizes the image to exactly fill the box, and draws it over the page, blending it by its transparency if any
+    def paste_image(self, image: Image, box: tuple):
+        left, top, right, bottom = box
+        box_size = (max(1, right - left), max(1, bottom - top))
+        if image.mode not in ["RGB", "RGBA"]:
+            image = image.convert("RGBA")
+        if image.size != box_size:
+            image = image.resize(box_size, Image.LANCZOS)
+
+        mask = image if image.mode == "RGBA" else None
+        self.image.paste(image, (left, top), mask)
+
+    # The (left, top, right, bottom) pixels of the box with the given bottom-left corner and size, in points
+    # The edges are rounded rather than the size, so boxes that touch on the page still touch in pixels
+    def get_pixel_box(self, x: float, y: float, width: float, height: float) -> tuple:
+        left, bottom = self.get_pixel_point(x, y)
+        right, top = self.get_pixel_point(x + width, y + height)
+        return (left, top, right, bottom)
+
+    def get_pixel_point(self, x: float, y: float) -> tuple:
+        return (round(x * self.scale), round((self.page_height - y) * self.scale))
+
+    def get_pixel_width(self, width: float) -> int:
+        return max(1, round(width * self.scale))
+
+
+# ImageDraw takes the last row and column of a box as part of it
+def get_inclusive_box(box: tuple) -> tuple:
+    left, top, right, bottom = box
+    return (left, top, max(left, right - 1), max(top, bottom - 1))
+
+
+# Fonts are only loaded once per size, as the same few sizes are used on every page
+@lru_cache(maxsize=None)
+def get_font(font_path: str, font_size: float) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font_path, font_size)
+
+
+# The frames are made of the same few images on every header, so each part is only recoloured and resized once per pixel size
+# The returned image is shared, so it must not be modified by the caller
+@lru_cache(maxsize=None)
+def get_frame_part_image(image_path: str, pixel_w: int, pixel_h: int) -> Image:
+    image = u.get_recoloured_image(image_path, u.FRAME_BG_COLOUR_PLACEHOLDER, u.FRAME_BG_COLOUR)
+    if image.mode not in ["RGB", "RGBA"]:
+        image = image.convert("RGBA")
+    return image.resize((max(1, pixel_w), max(1, pixel_h)), Image.LANCZOS)
@@ -0,0 +1,297 @@
+import io
+import os
+import json
+import copy
+import shutil
+import hashlib
+import tempfile
+import threading
+import contextlib
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import scripts.utils as u
+from scripts.set_filter import SetFilter, FilterError
+from scripts.catalog import CatalogError, load_catalog, get_snapshot_dir_path
+from scripts.asset_cache import get_file_hash
+from scripts.batch import get_generator, get_job_config
+
+DEFAULT_SERVER_HOST = "127.0.0.1"
+DEFAULT_SERVER_PORT = 8765
+DEFAULT_SERVER_CACHE_MAX_SIZE_MB = 256
+
+BYTES_PER_MB = 1024*1024
+
+# The value of the X-Cache header of each rendered PDF
+CACHE_STATUS_HIT = "hit"
+CACHE_STATUS_MISS = "miss"
+CACHE_STATUS_COALESCED = "coalesced"
+
+FILTERS_CONFIG_KEY = "filters"
+FILTERS_KEYS = ["included_sets", "excluded_sets"]
+
+
+class RenderError(Exception):
+    pass
+
+
+# A render requested by one client, that identical requests arriving in the meantime wait for instead of rendering it again
+class PendingRender():
+    def __init__(self):
+        self.done = threading.Event()
+        self.pdf_data = None
+        self.error = None
+
+
+# Renders PDFs for the config values of each request, keeping the catalog, fonts and caches of the process warm between requests
+# Finished PDFs are kept in memory, least recently used first out, keyed by the fingerprint of everything they're drawn from,
+# so a PDF is never served again once a set, an asset, the code or a rendering option changed
+# The catalog is loaded again whenever its file changes, and the pages rendered for incremental requests are only kept
+# as long as one of the request's PDFs is cached
+class RenderService():
+    def __init__(self, data, catalog_file_path: str, cache_max_size_mb: float):
+        self.data = data
+        self.catalog_file_path = catalog_file_path
+        self.catalog = data.catalog
+        self.catalog_hash = get_file_hash(catalog_file_path)
+        self.cache_max_size = cache_max_size_mb * BYTES_PER_MB
+        # The PDF data and the request key of each cached PDF, by PDF fingerprint
+        self.cached_pdfs = OrderedDict()
+        self.cached_pdfs_size = 0
+        self.pending_renders = {}
+        self.stats = {"requests": 0, "renders": 0, CACHE_STATUS_HIT: 0, CACHE_STATUS_MISS: 0, CACHE_STATUS_COALESCED: 0}
+        # Guards the cached PDFs, the pending renders and the stats
+        self.lock = threading.Lock()
+        # The generators and the utils module keep their state in the process, so only one request is planned and rendered at a time
+        self.render_lock = threading.Lock()
+
+        # The pages of the previous runs belong to PDFs that aren't cached anymore
+        self.page_cache_dir_path = os.path.join(data.cache_dir_path, "server")
+        shutil.rmtree(self.page_cache_dir_path, ignore_errors=True)
+
+    # Returns the PDF data for the given config values, and whether it came from the cache, another request or a new render
+    def render(self, request_config: dict) -> tuple:
+        request_key = hashlib.sha256(json.dumps(request_config, sort_keys=True).encode("utf-8")).hexdigest()
+        with self.lock:
+            self.stats["requests"] += 1
+            pending_render = self.pending_renders.get(request_key)
+            is_leader = pending_render is None
+            if is_leader:
+                pending_render = PendingRender()
+                self.pending_renders[request_key] = pending_render
+            else:
+                self.stats[CACHE_STATUS_COALESCED] += 1
+
+        if not is_leader:
+            pending_render.done.wait()
+            if pending_render.error:
+                raise pending_render.error
+            return pending_render.pdf_data, CACHE_STATUS_COALESCED
+
+        try:
+            pdf_data, cache_status = self.render_request(request_config, request_key)
+            pending_render.pdf_data = pdf_data
+            return pdf_data, cache_status
+        except Exception as error:
+            pending_render.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.pending_renders[request_key]
+            pending_render.done.set()
+
+    def render_request(self, request_config: dict, request_key: str) -> tuple:
+        check_request_config(self.data.config, request_config)
+        config = get_job_config(self.data.config, request_config)
+
+        with self.render_lock:
+            # The generators log every set, which isn't needed here
+            with contextlib.redirect_stdout(io.StringIO()):
+                try:
+                    generator = get_generator(config)
+                    u.set_font_selection(config.get("font_selection", u.FONT_SELECTION_RANGES))
+                    u.set_jpeg_quality(config.get("jpeg_quality", u.DEFAULT_JPEG_QUALITY))
+
+                    request_data = copy.copy(self.data)
+                    request_data.config = config
+                    request_data.catalog = SetFilter(config["filters"]).select(self.get_catalog())
+                    # Incremental builds keep the rendered pages of each distinct request apart, as for the jobs of a batch
+                    request_data.page_cache_dir_path = os.path.join(self.get_request_dir_path(request_key), "pages")
+                    header_layouts = generator.plan_headers(request_data)
+                except FilterError as error:
+                    raise RenderError(f"filter {error}")
+                except u.ConfigError as error:
+                    raise RenderError(str(error))
+
+                # Planning is quick, and tells whether any input of the PDF changed since it was cached
+                pdf_key = generator.get_pdf_fingerprint(request_data, header_layouts)
+                pdf_data = self.get_cached_pdf(pdf_key)
+                if pdf_data:
+                    return pdf_data, CACHE_STATUS_HIT
+
+                with tempfile.TemporaryDirectory() as tmp_dir_path:
+                    request_data.output_file_path = os.path.join(tmp_dir_path, "headers.pdf")
+                    generator.render(request_data, header_layouts)
+                    with open(request_data.output_file_path, "rb") as f:
+                        pdf_data = f.read()
+
+            # Still within the render lock, as it may delete the pages of another request
+            self.put_cached_pdf(pdf_key, pdf_data, request_key)
+        return pdf_data, CACHE_STATUS_MISS
+
+    # The catalog, loaded again if its file changed since it was last loaded
+    # Only called while rendering, so a single request loads it
+    def get_catalog(self) -> list:
+        catalog_hash = get_file_hash(self.catalog_file_path)
+        if catalog_hash != self.catalog_hash:
+            try:
+                self.catalog = load_catalog(self.catalog_file_path, get_snapshot_dir_path(self.data.config, self.data.cache_dir_path))
+            except ValueError as error:
+                # e.g. a catalog saved halfway through an edit
+                raise CatalogError(f"it isn't valid JSON ({error})")
+            self.catalog_hash = catalog_hash
+        return self.catalog
+
+    def get_request_dir_path(self, request_key: str) -> str:
+        return os.path.join(self.page_cache_dir_path, request_key[:16])
+
+    def get_cached_pdf(self, pdf_key: str) -> bytes:
+        with self.lock:
+            cached_pdf = self.cached_pdfs.get(pdf_key)
+            if cached_pdf is None:
+                return None
+            self.cached_pdfs.move_to_end(pdf_key)
+            self.stats[CACHE_STATUS_HIT] += 1
+            return cached_pdf[0]
+
+    def put_cached_pdf(self, pdf_key: str, pdf_data: bytes, request_key: str):
+        evicted_request_keys = []
+        with self.lock:
+            self.stats["renders"] += 1
+            self.stats[CACHE_STATUS_MISS] += 1
+            if len(pdf_data) > self.cache_max_size:
+                evicted_request_keys.append(request_key)
+            else:
+                self.cached_pdfs[pdf_key] = (pdf_data, request_key)
+                self.cached_pdfs_size += len(pdf_data)
+                while self.cached_pdfs_size > self.cache_max_size:
+                    _, (evicted_pdf_data, evicted_request_key) = self.cached_pdfs.popitem(last=False)
+                    self.cached_pdfs_size -= len(evicted_pdf_data)
+                    evicted_request_keys.append(evicted_request_key)
+            cached_request_keys = set([cached_request_key for _, cached_request_key in self.cached_pdfs.values()])
+
+        # The rendered pages of a request are deleted along with its last cached PDF
+        for evicted_request_key in set(evicted_request_keys) - cached_request_keys:
+            shutil.rmtree(self.get_request_dir_path(evicted_request_key), ignore_errors=True)
+
+    def get_status(self) -> dict:
+        with self.lock:
+            return dict(self.stats, cached_pdfs=len(self.cached_pdfs), cached_pdfs_size_mb=round(self.cached_pdfs_size / BYTES_PER_MB, 1))
+
+
+# Checks that the config values of the request have the same types as the ones of config.yaml they replace,
+# and that the filters are lists of selectors, so bad requests are answered with a 400 rather than failing mid-render
+def check_request_config(base_config: dict, request_config: dict):
+    for key, value in request_config.items():
+        if key == FILTERS_CONFIG_KEY:
+            check_request_filters(value)
+            continue
+        if value is None:
+            raise RenderError(f"\"{key}\" should have a value")
+        base_value = base_config.get(key)
+        if base_value is None:
+            continue
+        if not is_same_config_type(base_value, value):
+            raise RenderError(f"\"{key}\" should be {get_config_type_name(base_value)}, not {json.dumps(value)}")
+
+
+def check_request_filters(filters):
+    if not isinstance(filters, dict):
+        raise RenderError(f"\"{FILTERS_CONFIG_KEY}\" should be an object with included_sets and excluded_sets lists")
+    for key, selector_strings in filters.items():
+        if key not in FILTERS_KEYS:
+            raise RenderError(f"Unknown filter \"{key}\", expected {' or '.join(FILTERS_KEYS)}")
+        if selector_strings is not None and (not isinstance(selector_strings, list) or not all([isinstance(selector_string, str) for selector_string in selector_strings])):
+            raise RenderError(f"\"{key}\" should be a list of selectors")
+
+
+# Integers and floats stand for each other, but booleans only for booleans
+def is_same_config_type(base_value, value) -> bool:
+    if isinstance(base_value, bool) or isinstance(value, bool):
+        return isinstance(base_value, bool) and isinstance(value, bool)
+    if isinstance(base_value, (int, float)):
+        return isinstance(value, (int, float))
+    return isinstance(value, type(base_value))
+
+
+def get_config_type_name(base_value) -> str:
+    if isinstance(base_value, bool):
+        return "a boolean"
+    if isinstance(base_value, (int, float)):
+        return "a number"
+    return {str: "a text", list: "a list", dict: "an object"}.get(type(base_value), f"a {type(base_value).__name__}")
+
+
+# POST /render with a JSON object of config values (e.g. {"headers_type": "pages", "filters": {...}}),
+# which replace the ones of config.yaml, returns the PDF
+# GET /status returns the number of requests, renders and cache hits, and the size of the cache
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    render_service = None
+
+    def do_GET(self):
+        if self.path != "/status":
+            self.send_error(404)
+            return
+        self.send_data(200, "application/json", json.dumps(self.render_service.get_status()).encode("utf-8"))
+
+    def do_POST(self):
+        if self.path != "/render":
+            self.send_error(404)
+            return
+
+        try:
+            request_body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            request_config = json.loads(request_body or b"{}")
+            if not isinstance(request_config, dict):
+                raise ValueError("the body should be a JSON object")
+        except ValueError as error:
+            self.send_data(400, "text/plain; charset=utf-8", f"Invalid request: {error}".encode("utf-8"))
+            return
+
+        try:
+            pdf_data, cache_status = self.render_service.render(request_config)
+        except RenderError as error:
+            self.send_data(400, "text/plain; charset=utf-8", f"Invalid config: {error}".encode("utf-8"))
+            return
+        except CatalogError as error:
+            # The catalog file is loaded again by the next request, e.g. once the edit is saved in full
+            u.log(f"Invalid catalog: {error}")
+            self.send_data(500, "text/plain; charset=utf-8", f"Invalid catalog: {error}".encode("utf-8"))
+            return
+        except Exception as error:
+            u.log(f"Render failed: {error!r}")
+            self.send_data(500, "text/plain; charset=utf-8", f"Render failed: {error!r}".encode("utf-8"))
+            return
+        self.send_data(200, "application/pdf", pdf_data, {"X-Cache": cache_status})
+
+    def send_data(self, status: int, content_type: str, data: bytes, headers: dict = {}):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+# Serves renders until interrupted
+def serve(data, catalog_file_path: str, host: str, port: int, cache_max_size_mb: float):
+    RenderRequestHandler.render_service = RenderService(data, catalog_file_path, cache_max_size_mb)
+    server = ThreadingHTTPServer((host, port), RenderRequestHandler)
+    u.log(f"Serving renders on http://{host}:{port}/render, press Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,206 @@
+import re
+import fnmatch
+from typing import Iterable, Iterator
+
+from scripts.catalog import CatalogSerie, CatalogSet, parse_date
+
+SELECTOR_REGION_PREFIX = "region:"
+SELECTOR_DATE_PREFIX = "date:"
+SELECTOR_NAME_PREFIX = "name:"
+SELECTOR_DATE_RANGE_SEPARATOR = ".."
+
+GLOB_CHARS = "*?["
+
+# The terms of a selector are separated by spaces, and the text of a prefixed term can be quoted to contain spaces (e.g. name:"black star")
+# Quotes elsewhere are kept as they are, so ids and names with an apostrophe don't need any quoting
+SELECTOR_PREFIXES_PATTERN = "|".join([re.escape(prefix) for prefix in [SELECTOR_REGION_PREFIX, SELECTOR_DATE_PREFIX, SELECTOR_NAME_PREFIX]])
+SELECTOR_TERM_PATTERN = re.compile(rf"""({SELECTOR_PREFIXES_PATTERN})(?:"([^"]*)"|'([^']*)')(?=\s|$)|\S+""")
+
+
+# Raised with the filter and the reason it's invalid
+class FilterError(Exception):
+    pass
+
+
+# The included_sets and excluded_sets filters, compiled once so that each set is checked in about constant time
+# A set is selected if any of the included selectors match it, and none of the excluded ones do
+class SetFilter():
+    def __init__(self, filters: dict):
+        self.included_selectors = SelectorTable(filters.get("included_sets") or [])
+        self.excluded_selectors = SelectorTable(filters.get("excluded_sets") or [])
+
+    def is_set_included(self, serie_id: str, set: CatalogSet) -> bool:
+        return self.included_selectors.matches(serie_id, set) and not self.excluded_selectors.matches(serie_id, set)
+
+    # Returns the catalog with only the selected sets, and only the series with at least one of them
+    # Series with all of their sets selected are kept as they are rather than copied
+    def select(self, catalog: list) -> list:
+        return list(self.iter_select(catalog))
+
+    # Yields the selected series one at a time, e.g. as they are read from the catalog file
+    def iter_select(self, series: Iterable[CatalogSerie]) -> Iterator[CatalogSerie]:
+        for serie in series:
+            serie_id = serie.id
+            selected_sets = [set for set in serie.sets if self.is_set_included(serie_id, set)]
+            if len(selected_sets) == len(serie.sets):
+                if selected_sets:
+                    yield serie
+            elif selected_sets:
+                yield serie.with_sets(selected_sets)
+
+
+# A list of selectors, sorted into hash tables by kind
+# Plain "<serie_id>/<set_id>" selectors with or without wildcards are looked up directly,
+# while glob patterns are merged into a single regex and the other selectors are checked one by one
+class SelectorTable():
+    def __init__(self, selector_strings: list):
+        self.matches_all = False
+        self.serie_set_ids = set()
+        self.serie_ids = set()
+        self.set_ids = set()
+        self.glob_regex = None
+        self.selectors = []
+
+        glob_patterns = []
+        for selector_string in selector_strings:
+            selector = compile_selector(selector_string)
+            if selector.region is not None or selector.date_range is not None or selector.name is not None:
+                self.selectors.append(selector)
+            elif selector.glob_pattern is not None:
+                glob_patterns.append(selector.glob_pattern)
+            elif selector.serie_id is None and selector.set_id is None:
+                self.matches_all = True
+            elif selector.set_id is None:
+                self.serie_ids.add(selector.serie_id)
+            elif selector.serie_id is None:
+                self.set_ids.add(selector.set_id)
+            else:
+                self.serie_set_ids.add((selector.serie_id, selector.set_id))
+
+        if glob_patterns:
+            self.glob_regex = re.compile("|".join([f"(?:{fnmatch.translate(glob_pattern)})" for glob_pattern in glob_patterns]))
+
+    def matches(self, serie_id: str, set: CatalogSet) -> bool:
+        set_id = set.id
+        if self.matches_all or serie_id in self.serie_ids or set_id in self.set_ids or (serie_id, set_id) in self.serie_set_ids:
+            return True
+        if self.glob_regex and self.glob_regex.match(f"{serie_id}/{set_id}"):
+            return True
+        for selector in self.selectors:
+            if selector.matches(serie_id, set):
+                return True
+        return False
+
+
+# A single selector, whose space separated terms must all match the set:
+# "<serie_id>/<set_id>" where either part can be * or a glob pattern (e.g. "sword-&-shield/*", "*/*-promos", "base-set/base-set-?")
+# "region:<region>" (e.g. "region:jpn"), for the sets of the given region, which is "eng" when not specified in the catalog
+# "date:<from>..<to>" (e.g. "date:1999..2002", "date:03/2023..", "date:..31/12/2010"), in the catalog date format, with inclusive bounds
+# "name:<text>" (e.g. "name:promo", or name:"black star" with quotes when the text has spaces), for the sets whose names contain the text, ignoring case
+class SetSelector():
+    __slots__ = ("serie_id", "set_id", "glob_pattern", "region", "date_range", "name")
+
+    def __init__(self):
+        self.serie_id = None
+        self.set_id = None
+        self.glob_pattern = None
+        self.region = None
+        self.date_range = None
+        self.name = None
+
+    def matches(self, serie_id: str, set: CatalogSet) -> bool:
+        if self.serie_id is not None and self.serie_id != serie_id:
+            return False
+        if self.set_id is not None and self.set_id != set.id:
+            return False
+        if self.glob_pattern is not None and not fnmatch.fnmatchcase(f"{serie_id}/{set.id}", self.glob_pattern):
+            return False
+        if self.region is not None and set.region != self.region:
+            return False
+        if self.date_range is not None and not is_date_in_range(set.parsed_date, self.date_range):
+            return False
+        if self.name is not None and not any([self.name in search_name for search_name in set.search_names]):
+            return False
+        return True
+
+
+def compile_selector(selector_string: str) -> SetSelector:
+    selector = SetSelector()
+    if not isinstance(selector_string, str):
+        raise FilterError(f"{selector_string!r}: it should be a text")
+    terms = get_selector_terms(selector_string)
+    if not terms:
+        raise_selector_error(selector_string, "it is empty")
+
+    for term in terms:
+        if term.startswith(SELECTOR_REGION_PREFIX):
+            selector.region = term[len(SELECTOR_REGION_PREFIX):]
+        elif term.startswith(SELECTOR_DATE_PREFIX):
+            selector.date_range = parse_date_range(selector_string, term[len(SELECTOR_DATE_PREFIX):])
+        elif term.startswith(SELECTOR_NAME_PREFIX):
+            selector.name = term[len(SELECTOR_NAME_PREFIX):].casefold()
+        else:
+            id_parts = term.split("/")
+            if len(id_parts) != 2 or not id_parts[0] or not id_parts[1]:
+                raise_selector_error(selector_string, "it should be in the \"<serie_id>/<set_id>\" format")
+            serie_id, set_id = id_parts
+            if is_glob_pattern(serie_id) or is_glob_pattern(set_id):
+                selector.glob_pattern = term
+            else:
+                selector.serie_id = None if serie_id == "*" else serie_id
+                selector.set_id = None if set_id == "*" else set_id
+    return selector
+
+
+def get_selector_terms(selector_string: str) -> list:
+    terms = []
+    for match in SELECTOR_TERM_PATTERN.finditer(selector_string):
+        prefix, double_quoted_text, single_quoted_text = match.groups()
+        if prefix is None:
+            terms.append(match.group(0))
+        else:
+            terms.append(prefix + (double_quoted_text if double_quoted_text is not None else single_quoted_text))
+    return terms
+
+
+# A lone * matches any id and is looked up without a pattern
+def is_glob_pattern(id_part: str) -> bool:
+    return id_part != "*" and any([char in id_part for char in GLOB_CHARS])
+
+
+def parse_date_range(selector_string: str, date_range_string: str) -> tuple:
+    if SELECTOR_DATE_RANGE_SEPARATOR not in date_range_string:
+        # A single date selects that day, month or year
+        date = parse_date(date_range_string)
+        if date is None:
+            raise_selector_error(selector_string, f"\"{date_range_string}\" isn't a date")
+        return (date, date)
+
+    from_string, to_string = date_range_string.split(SELECTOR_DATE_RANGE_SEPARATOR, 1)
+    from_date = parse_date(from_string) if from_string else None
+    to_date = parse_date(to_string) if to_string else None
+    if (from_string and from_date is None) or (to_string and to_date is None) or (from_date is None and to_date is None):
+        raise_selector_error(selector_string, f"\"{date_range_string}\" isn't a date range")
+    return (from_date, to_date)
+
+
+# Partial dates are compared on the parts both dates have, so that "2003" is within "01/06/2003.." and "..03/2003"
+# The date is the parsed date of the set, which has none when the catalog doesn't give one
+def is_date_in_range(date: tuple, date_range: tuple) -> bool:
+    if date is None:
+        return False
+
+    from_date, to_date = date_range
+    if from_date is not None:
+        precision = min(len(date), len(from_date))
+        if date[:precision] < from_date[:precision]:
+            return False
+    if to_date is not None:
+        precision = min(len(date), len(to_date))
+        if date[:precision] > to_date[:precision]:
+            return False
+    return True
+
+
+def raise_selector_error(selector_string: str, reason: str):
+    raise FilterError(f"\"{selector_string}\": {reason}")
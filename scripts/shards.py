@@ -0,0 +1,161 @@
+import os
+import re
+import copy
+import json
+import argparse
+from pypdf import PdfReader
+
+import scripts.utils as u
+import scripts.timing as timing
+from scripts.asset_cache import get_file_hash
+from scripts.generators.generator import get_pages
+from scripts.pdf_stream_writer import PdfStreamWriter
+
+SHARD_MANIFEST_VERSION = 1
+
+SHARD_FILENAME_PATTERN = re.compile(r"^shard-(\d+)-of-(\d+)\.json$")
+
+
+# Parses the value of --shard, e.g. "2/4" for the second of 4 shards
+def parse_shard(value: str) -> tuple:
+    match = re.fullmatch(r"(\d+)/(\d+)", value.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f"\"{value}\" should be in the \"<shard>/<shards count>\" format, e.g. 2/4")
+    shard_index, shards_count = int(match.group(1)), int(match.group(2))
+    if shards_count < 1 or not 1 <= shard_index <= shards_count:
+        raise argparse.ArgumentTypeError(f"\"{value}\" should have a shard between 1 and the shards count")
+    return shard_index, shards_count
+
+
+def get_shard_name(shard_index: int, shards_count: int) -> str:
+    return f"shard-{shard_index}-of-{shards_count}"
+
+
+# Returns the pages of the given shard: the pages are split, in order, into shards_count contiguous runs of (nearly) the same size
+# Every shard plans the whole catalog the same way, so they all agree on the pages of each shard without talking to each other,
+# and a page (e.g. the 9 headers of a cards page) is never split across shards
+def get_shard_pages(pages: list, shard_index: int, shards_count: int) -> tuple:
+    first_page_index = len(pages) * (shard_index - 1) // shards_count
+    last_page_index = len(pages) * shard_index // shards_count
+    return first_page_index, pages[first_page_index:last_page_index]
+
+
+# Plans every header, but only renders the pages of the shard, to a partial PDF in the shards folder
+# A manifest is written next to it, with the pages it holds and the fingerprint of the whole plan, for merge_shards to check
+def generate_shard(generator, data, shard_index: int, shards_count: int, shard_dir_path: str):
+    with timing.time_stage(timing.STAGE_PLAN):
+        header_layouts = generator.plan_headers(data)
+        pages = get_pages(header_layouts)
+        plan_fingerprint = generator.get_pdf_fingerprint(data, header_layouts)
+
+    first_page_index, shard_pages = get_shard_pages(pages, shard_index, shards_count)
+    shard_name = get_shard_name(shard_index, shards_count)
+    shard_file_path = os.path.join(shard_dir_path, f"{shard_name}.pdf")
+    os.makedirs(shard_dir_path, exist_ok=True)
+
+    u.log("")
+    if shard_pages:
+        u.log(f"Shard {shard_index}/{shards_count}: rendering pages {first_page_index + 1} to {first_page_index + len(shard_pages)} of {len(pages)}")
+
+        # Each shard keeps its own rendered pages, so shards run side by side don't replace each other's
+        shard_data = copy.copy(data)
+        shard_data.output_file_path = shard_file_path
+        shard_data.page_cache_dir_path = os.path.join(data.cache_dir_path, "shards", shard_name, "pages")
+        with timing.time_stage(timing.STAGE_RENDER):
+            generator.render(shard_data, [header_layout for page_headers in shard_pages for header_layout in page_headers])
+    else:
+        u.log(f"Shard {shard_index}/{shards_count}: no pages to render, there are only {len(pages)} pages")
+        if os.path.exists(shard_file_path):
+            os.remove(shard_file_path)
+
+    shard_manifest = {
+        "version": SHARD_MANIFEST_VERSION,
+        "shard": shard_index,
+        "shards_count": shards_count,
+        "plan_fingerprint": plan_fingerprint,
+        "pages_count": len(pages),
+        "first_page": first_page_index + 1,
+        "shard_pages_count": len(shard_pages),
+        "pdf_file_name": os.path.basename(shard_file_path) if shard_pages else None,
+        "pdf_hash": get_file_hash(shard_file_path) if shard_pages else None
+    }
+    # Write to a temporary file first, so a manifest is never seen before its PDF is complete
+    shard_manifest_file_path = os.path.join(shard_dir_path, f"{shard_name}.json")
+    tmp_shard_manifest_file_path = f"{shard_manifest_file_path}.{os.getpid()}.tmp"
+    with open(tmp_shard_manifest_file_path, "w", encoding="utf-8") as f:
+        json.dump(shard_manifest, f, indent=2)
+    os.replace(tmp_shard_manifest_file_path, shard_manifest_file_path)
+    u.log(f"Shard manifest written to {shard_manifest_file_path}")
+
+
+# Checks that the shards folder holds every shard of the same plan, each with its complete PDF,
+# then concatenates the shards in page order into the output PDF
+def merge_shards(shard_dir_path: str, output_file_path: str):
+    shard_manifests = load_shard_manifests(shard_dir_path)
+    check_shard_manifests(shard_dir_path, shard_manifests)
+
+    shard_file_paths = [os.path.join(shard_dir_path, shard_manifest["pdf_file_name"]) for shard_manifest in shard_manifests if shard_manifest["shard_pages_count"]]
+    with timing.time_stage(timing.STAGE_PDF_MERGE):
+        with PdfStreamWriter(output_file_path) as pdf_writer:
+            for shard_file_path in shard_file_paths:
+                pdf_writer.append(shard_file_path)
+
+    u.log(f"{len(shard_manifests)} shards with {shard_manifests[0]['pages_count']} pages merged into {output_file_path}")
+    u.log(f"PDF size: {os.path.getsize(output_file_path) / (1024*1024):.1f} MB")
+
+
+# Returns the manifests of the shards in the folder, in shard order
+def load_shard_manifests(shard_dir_path: str) -> list:
+    shard_manifests = []
+    if os.path.isdir(shard_dir_path):
+        for file_name in os.listdir(shard_dir_path):
+            if SHARD_FILENAME_PATTERN.match(file_name):
+                shard_manifests.append(u.parse_json(os.path.join(shard_dir_path, file_name)))
+
+    if not shard_manifests:
+        u.log(f"No shard manifests in {shard_dir_path}. Aborting.")
+        exit(1)
+    if any([shard_manifest.get("version") != SHARD_MANIFEST_VERSION for shard_manifest in shard_manifests]):
+        u.log(f"Some shards in {shard_dir_path} were generated by another version of the script. Aborting.")
+        exit(1)
+    return sorted(shard_manifests, key=lambda shard_manifest: (shard_manifest["shards_count"], shard_manifest["shard"]))
+
+
+def check_shard_manifests(shard_dir_path: str, shard_manifests: list):
+    # Every shard must come from the same split of the same plan, i.e. the same catalog, config, assets and code
+    shards_counts = set([shard_manifest["shards_count"] for shard_manifest in shard_manifests])
+    if len(shards_counts) > 1:
+        u.log(f"The shards in {shard_dir_path} are from splits in {', '.join([str(count) for count in sorted(shards_counts)])} shards, delete the old ones. Aborting.")
+        exit(1)
+    if len(set([shard_manifest["plan_fingerprint"] for shard_manifest in shard_manifests])) > 1:
+        u.log(f"The shards in {shard_dir_path} were generated from different catalogs, configs, assets or code. Aborting.")
+        exit(1)
+
+    shards_count = shard_manifests[0]["shards_count"]
+    missing_shards = sorted(set(range(1, shards_count + 1)) - set([shard_manifest["shard"] for shard_manifest in shard_manifests]))
+    if missing_shards:
+        u.log(f"Missing shards {', '.join([str(shard) for shard in missing_shards])} of {shards_count} in {shard_dir_path}. Aborting.")
+        exit(1)
+
+    # The shards must follow each other, from the first page to the last one
+    next_page = 1
+    for shard_manifest in shard_manifests:
+        shard_name = f"{shard_manifest['shard']}/{shards_count}"
+        if shard_manifest["first_page"] != next_page:
+            u.log(f"Shard {shard_name} starts at page {shard_manifest['first_page']} instead of {next_page}. Aborting.")
+            exit(1)
+        next_page += shard_manifest["shard_pages_count"]
+
+        if not shard_manifest["shard_pages_count"]:
+            continue
+        shard_file_path = os.path.join(shard_dir_path, shard_manifest["pdf_file_name"])
+        if not os.path.exists(shard_file_path) or get_file_hash(shard_file_path) != shard_manifest["pdf_hash"]:
+            u.log(f"The PDF of shard {shard_name} is missing or isn't the one it was generated with. Aborting.")
+            exit(1)
+        if len(PdfReader(shard_file_path).pages) != shard_manifest["shard_pages_count"]:
+            u.log(f"The PDF of shard {shard_name} doesn't have {shard_manifest['shard_pages_count']} pages. Aborting.")
+            exit(1)
+
+    if next_page - 1 != shard_manifests[0]["pages_count"]:
+        u.log(f"The shards have {next_page - 1} pages instead of {shard_manifests[0]['pages_count']}. Aborting.")
+        exit(1)
@@ -0,0 +1,111 @@
+import os
+import json
+import random
+from PIL import Image, ImageDraw
+
+import scripts.utils as u
+
+SYNTHETIC_CATALOG_VERSION = 1
+
+SYNTHETIC_CATALOG_FILE_NAME = "catalog.json"
+SYNTHETIC_CATALOG_PARAMS_FILE_NAME = "params.json"
+
+# Cover sizes and formats, mixing small and big, portrait and landscape, photos and images with transparency
+COVER_SIZES = [(600, 825), (1200, 1650), (2400, 3300), (1650, 1200), (800, 800)]
+COVER_FORMATS = [("cover.jpg", "JPEG", "RGB"), ("cover.png", "PNG", "RGB"), ("cover.png", "PNG", "RGBA")]
+SYMBOL_SIZES = [(64, 64), (256, 256), (512, 384)]
+MAX_SYMBOLS_PER_SET = 3
+
+REGIONS = ["eng", "jpn", "all"]
+
+ENG_WORDS = ["Base", "Set", "Rising", "Legends", "Ancient", "Storm", "Crystal", "Shadows", "Evolutions", "Promo", "Collection", "Black", "Star", "Paradox", "Rift", "Obsidian", "Flames", "Temporal", "Forces", "Journey", "Together"]
+JPN_WORDS = ["ポケモン", "カード", "ゲーム", "拡張", "パック", "強化", "ハイクラス", "スターター", "セット", "黒炎", "支配者", "古代", "未来", "変幻", "仮面", "超電", "ブレイカー"]
+
+
+# Writes a catalog with the given number of sets to the given folder, with generated covers and symbols in its assets folder
+# The sets have mixed regions, single and multi-line English names, Japanese names and covers of varied sizes and formats
+# The catalog is only generated again if the given parameters changed since the last time
+# Returns the path of the catalog file
+def generate_synthetic_catalog(catalog_dir_path: str, sets_count: int, sets_per_serie: int, seed: int) -> str:
+    catalog_file_path = os.path.join(catalog_dir_path, SYNTHETIC_CATALOG_FILE_NAME)
+    params_file_path = os.path.join(catalog_dir_path, SYNTHETIC_CATALOG_PARAMS_FILE_NAME)
+    params = {
+        "version": SYNTHETIC_CATALOG_VERSION,
+        "sets_count": sets_count,
+        "sets_per_serie": sets_per_serie,
+        "seed": seed
+    }
+
+    if os.path.exists(catalog_file_path) and os.path.exists(params_file_path) and u.parse_json(params_file_path) == params:
+        return catalog_file_path
+
+    rng = random.Random(seed)
+    catalog = []
+    for set_index in range(sets_count):
+        if set_index % sets_per_serie == 0:
+            serie_id = f"serie-{len(catalog) + 1}"
+            catalog.append({
+                "id": serie_id,
+                "name": get_random_name(rng, ENG_WORDS, " ", 1, 3),
+                "sets": []
+            })
+
+        set_id = f"set-{set_index + 1}"
+        set_region = rng.choice(REGIONS)
+        set_names = {"eng": get_random_name(rng, ENG_WORDS, " ", 1, 5)}
+        # Some names are split over multiple lines, as in the real catalog
+        if rng.random() < 0.3:
+            set_names["eng"] = set_names["eng"].replace(" ", "\n", rng.randint(1, 2))
+        if set_region != "eng":
+            set_names[set_region] = get_random_name(rng, JPN_WORDS, "", 1, 4)
+
+        catalog[-1]["sets"].append({
+            "id": set_id,
+            "names": set_names,
+            "region": set_region,
+            "date": f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(1999, 2025)}"
+        })
+
+        set_dir_path = os.path.join(catalog_dir_path, "assets", serie_id, set_id)
+        os.makedirs(set_dir_path, exist_ok=True)
+        write_synthetic_cover(rng, set_dir_path)
+        for symbol_index in range(rng.randint(0, MAX_SYMBOLS_PER_SET)):
+            symbol_file_name = "symbol.png" if symbol_index == 0 else f"symbol{symbol_index + 1}.png"
+            write_synthetic_symbol(rng, os.path.join(set_dir_path, symbol_file_name))
+
+    with open(catalog_file_path, "w", encoding="utf-8") as f:
+        json.dump(catalog, f, ensure_ascii=False, indent=2)
+    with open(params_file_path, "w", encoding="utf-8") as f:
+        json.dump(params, f, indent=2)
+
+    return catalog_file_path
+
+
+def get_random_name(rng: random.Random, words: list, separator: str, min_words: int, max_words: int) -> str:
+    return separator.join(rng.choices(words, k=rng.randint(min_words, max_words)))
+
+
+# A gradient with a few shapes on it, so that the covers compress more like photos than flat colours do
+def write_synthetic_cover(rng: random.Random, set_dir_path: str):
+    cover_w, cover_h = rng.choice(COVER_SIZES)
+    cover_file_name, cover_format, cover_mode = rng.choice(COVER_FORMATS)
+
+    cover = Image.linear_gradient("L").resize((cover_w, cover_h)).rotate(rng.randint(0, 359), expand=False, fillcolor=128)
+    cover = Image.merge("RGB", [cover.point(lambda value, offset=rng.randint(0, 255): (value + offset) % 256) for _ in range(3)])
+    draw = ImageDraw.Draw(cover)
+    for _ in range(rng.randint(3, 12)):
+        x, y = rng.randint(0, cover_w), rng.randint(0, cover_h)
+        radius = rng.randint(cover_w // 20, cover_w // 4)
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=tuple(rng.choices(range(256), k=3)))
+
+    if cover_mode == "RGBA":
+        cover.putalpha(255)
+    cover.save(os.path.join(set_dir_path, cover_file_name), format=cover_format)
+
+
+def write_synthetic_symbol(rng: random.Random, symbol_file_path: str):
+    symbol_w, symbol_h = rng.choice(SYMBOL_SIZES)
+    symbol = Image.new("RGBA", (symbol_w, symbol_h), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(symbol)
+    draw.polygon([(rng.randint(0, symbol_w), rng.randint(0, symbol_h)) for _ in range(rng.randint(3, 7))], fill=tuple(rng.choices(range(256), k=3)) + (255,))
+    symbol.save(symbol_file_path, format="PNG")
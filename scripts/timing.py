@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import threading
+
+# The timed stages, in the order they are listed in the summary
+STAGE_CATALOG_PARSE = "catalog parse"
+STAGE_ASSET_LOOKUP = "asset lookup"
+STAGE_FILTERING = "filtering"
+STAGE_TEXT_FITTING = "text fitting"
+STAGE_PLAN = "plan"
+STAGE_RENDER = "render"
+STAGE_FONT_REGISTRATION = "font registration"
+STAGE_IMAGE_PROCESSING = "image decode/crop/resize"
+STAGE_IMAGE_ENCODING = "image encode"
+STAGE_IMAGE_EMBEDDING = "image embed"
+STAGE_FRAME_DRAWING = "frame drawing"
+STAGE_PDF_SAVE = "pdf save"
+STAGE_PDF_MERGE = "pdf merge"
+STAGE_PREVIEW_SAVE = "preview save"
+STAGES = [
+    STAGE_CATALOG_PARSE, STAGE_ASSET_LOOKUP, STAGE_FILTERING, STAGE_TEXT_FITTING, STAGE_PLAN,
+    STAGE_RENDER, STAGE_FONT_REGISTRATION, STAGE_IMAGE_PROCESSING, STAGE_IMAGE_ENCODING, STAGE_IMAGE_EMBEDDING,
+    STAGE_FRAME_DRAWING, STAGE_PDF_SAVE, STAGE_PDF_MERGE, STAGE_PREVIEW_SAVE
+]
+
+# Opt-in timing of the generation stages, to see where the time goes and spot the stages that got slower
+# Nothing is recorded until enable() is called, so the timed code costs next to nothing otherwise
+enabled = False
+start_time = None
+
+# The timed stages, as (stage, start time, duration, process id, thread id), with times in seconds
+# Stages can be nested (e.g. font registration happens while rendering) and run in multiple threads and processes
+# The perf_counter origin differs between processes, so start times are wall-clock times, which the worker processes share
+events = []
+events_lock = threading.Lock()
+
+# The wall-clock time of the perf_counter origin of this process, to turn precise perf_counter times into wall-clock times
+wall_clock_offset = time.time() - time.perf_counter()
+
+
+class StageTimer():
+    __slots__ = ("stage", "stage_start_time")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.stage_start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.stage_start_time
+        with events_lock:
+            events.append((self.stage, wall_clock_offset + self.stage_start_time, duration, os.getpid(), threading.get_ident()))
+        return False
+
+
+# Used in place of a StageTimer when timing isn't enabled
+class NoStageTimer():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NO_STAGE_TIMER = NoStageTimer()
+
+
+def enable():
+    global enabled, start_time
+    enabled = True
+    if start_time is None:
+        start_time = time.perf_counter()
+
+
+# Times the code run within the returned context, e.g. "with timing.time_stage(timing.STAGE_PDF_SAVE):"
+def time_stage(stage: str):
+    if not enabled:
+        return NO_STAGE_TIMER
+    return StageTimer(stage)
+
+
+# Returns the events recorded so far and forgets them, e.g. to send them from a worker process to the main one
+def collect_events() -> list:
+    global events
+    with events_lock:
+        collected_events = events
+        events = []
+    return collected_events
+
+
+def add_events(new_events: list):
+    with events_lock:
+        events.extend(new_events)
+
+
+# Returns, for each stage, how many times it ran and for how long in total
+def get_summary() -> dict:
+    summary = {}
+    for stage, _, duration, _, _ in events:
+        calls, total_duration = summary.get(stage, (0, 0))
+        summary[stage] = (calls + 1, total_duration + duration)
+    return summary
+
+
+# The stages of the summary in the order of STAGES, followed by any other stage
+def get_ordered_stages(summary: dict) -> list:
+    return [stage for stage in STAGES if stage in summary] + sorted([stage for stage in summary if stage not in STAGES])
+
+
+# The summary as a table, one line per stage
+# Stages running in multiple threads or processes may add up to more than the wall time
+def get_summary_lines() -> list:
+    wall_time = time.perf_counter() - start_time
+    summary = get_summary()
+    ordered_stages = get_ordered_stages(summary)
+
+    lines = [f"{'Stage':<26}{'Calls':>8}{'Total (s)':>12}{'Mean (ms)':>12}{'% of wall':>11}"]
+    for stage in ordered_stages:
+        calls, total_duration = summary[stage]
+        lines.append(f"{stage:<26}{calls:>8}{total_duration:>12.3f}{1000 * total_duration / calls:>12.3f}{100 * total_duration / wall_time:>10.1f}%")
+    lines.append(f"{'wall':<26}{'':>8}{wall_time:>12.3f}")
+    return lines
+
+
+# Writes the events in the Chrome trace format (viewable in chrome://tracing or Perfetto), along with the summary
+# The events of every process are placed relative to when timing was enabled in the main process
+def write_trace(trace_file_path: str):
+    trace_start_time = wall_clock_offset + start_time
+    trace_events = []
+    for stage, stage_start_time, duration, pid, tid in events:
+        trace_events.append({
+            "name": stage,
+            "ph": "X",
+            "ts": round((stage_start_time - trace_start_time) * 1000000, 1),
+            "dur": round(duration * 1000000, 1),
+            "pid": pid,
+            "tid": tid
+        })
+
+    summary = get_summary()
+    trace = {
+        "traceEvents": trace_events,
+        "displayTimeUnit": "ms",
+        "otherData": {
+            "wall_time_s": round(time.perf_counter() - start_time, 6),
+            "stages": {stage: {"calls": calls, "total_s": round(total_duration, 6)} for stage, (calls, total_duration) in summary.items()}
+        }
+    }
+    with open(trace_file_path, "w", encoding="utf-8") as f:
+        json.dump(trace, f)
@@ -1,13 +1,29 @@
 import io
 import os
 import json
+import math
+import re
+import threading
 import yaml
+from bisect import bisect_right
+from functools import lru_cache
+from weakref import WeakKeyDictionary
+from typing import Iterator
+from reportlab import rl_config
 from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.lib.utils import ImageReader
+from reportlab.lib.units import inch
 from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen.canvas import Canvas
-from PIL import Image
+from PIL import Image, ImageChops
+
+from scripts.asset_cache import AssetCache, ASSET_CACHE_FORMAT_PNG, ASSET_CACHE_FORMAT_JPEG, get_file_hash
+from scripts.font_cache import load_font
+from scripts.pdf_stream_writer import PdfStreamWriter
+import scripts.timing as timing
+
+# Embed image data as binary rather than as ASCII85 text, which is a quarter bigger and slow to encode without reportlab's C extension
+rl_config.useA85 = 0
 
 FONT_ENG = "Font_ENG"
 FONT_BOLD_ENG = "Font_ENG_Bold"
@@ -20,6 +36,20 @@ FONT_WEIGHT_REGULAR = "regular"
 FONT_WEIGHT_BOLD = "bold"
 FONT_WEIGHT_HANDWRITING = "handwriting"
 
+ENG_FONT_NAMES = {
+    FONT_WEIGHT_REGULAR: FONT_ENG,
+    FONT_WEIGHT_BOLD: FONT_BOLD_ENG,
+    FONT_WEIGHT_HANDWRITING: FONT_HANDWRITING_ENG
+}
+JPN_FONT_NAMES = {
+    FONT_WEIGHT_REGULAR: FONT_JPN,
+    FONT_WEIGHT_BOLD: FONT_BOLD_JPN,
+    FONT_WEIGHT_HANDWRITING: FONT_HANDWRITING_JPN
+}
+
+FONT_SELECTION_RANGES = "ranges"
+FONT_SELECTION_COVERAGE = "coverage"
+
 V_ALIGN_TOP = "top"
 V_ALIGN_MIDDLE = "middle"
 V_ALIGN_BOTTOM = "bottom"
@@ -29,8 +59,23 @@ H_ALIGN_RIGHT = "right"
 
 DEFAULT_TEXT_SIZE = 12
 
+DEFAULT_PRINT_DPI = 300
+DEFAULT_DRAFT_DPI = 72
+
+DEFAULT_JPEG_QUALITY = 90
+
+# How each image is embedded in the PDF
+IMAGE_ENCODING_JPEG_AS_IS = "jpeg_as_is"
+IMAGE_ENCODING_JPEG = "jpeg"
+IMAGE_ENCODING_LOSSLESS = "lossless"
+
 LOG_INDENT = "  "
 
+# How much of a JSON file is read at a time when its items are parsed one by one
+JSON_READ_BLOCK_SIZE = 64*1024
+# The whitespace allowed between the values of a JSON file
+JSON_WHITESPACE_PATTERN = re.compile(r"[ \t\n\r]*")
+
 FRAME_BG_COLOUR_PLACEHOLDER = (255, 0, 0, 255)
 FRAME_BG_COLOUR = (255, 255, 255, 180)
 # Hack: need to shift each frame part by this amount in order to get rid of a miniscule gap
@@ -52,6 +97,9 @@ ASIAN_CHAR_RANGES = [
   {"from": ord(u"\U0002b740"), "to": ord(u"\U0002b81f")},
   {"from": ord(u"\U0002b820"), "to": ord(u"\U0002ceaf")}  # included as of Unicode 8.0
 ]
+# The same ranges as a sorted table, to look up code points with a binary search
+ASIAN_CHAR_RANGE_STARTS = [range["from"] for range in sorted(ASIAN_CHAR_RANGES, key=lambda range: range["from"])]
+ASIAN_CHAR_RANGE_ENDS = [range["to"] for range in sorted(ASIAN_CHAR_RANGES, key=lambda range: range["from"])]
 
 frame_top_left_path = ""
 frame_top_path = ""
@@ -63,22 +111,41 @@ frame_bottom_left_path = ""
 frame_left_path = ""
 frame_centre_path = ""
 
+font_paths = {}
+font_cache_dir = None
+registered_font_names = set()
+font_selection = FONT_SELECTION_RANGES
+
+asset_cache = None
 
-def init(fonts_dir_path: str, frame_imgs_dir_path: str):
-    # Register English fonts
-    eng_regular_font_path = os.path.join(fonts_dir_path, "Roboto/Roboto-Regular.ttf")
-    pdfmetrics.registerFont(TTFont(FONT_ENG, eng_regular_font_path))
-    eng_bold_font_path = os.path.join(fonts_dir_path, "Roboto/Roboto-Bold.ttf")
-    pdfmetrics.registerFont(TTFont(FONT_BOLD_ENG, eng_bold_font_path))
-    eng_handwriting_font_path = os.path.join(fonts_dir_path, "PlaywriteGBS/PlaywriteGBS-Regular.ttf")
-    pdfmetrics.registerFont(TTFont(FONT_HANDWRITING_ENG, eng_handwriting_font_path))
-    # Register Japanese fonts
-    jpn_regular_font_path = os.path.join(fonts_dir_path, "NotoSansJP/NotoSansJP-Regular.ttf")
-    pdfmetrics.registerFont(TTFont(FONT_JPN, jpn_regular_font_path))
-    jpn_bold_font_path = os.path.join(fonts_dir_path, "NotoSansJP/NotoSansJP-Bold.ttf")
-    pdfmetrics.registerFont(TTFont(FONT_BOLD_JPN, jpn_bold_font_path))
-    jpn_handwriting_font_path = os.path.join(fonts_dir_path, "HachiMaruPop/HachiMaruPop-Regular.ttf")
-    pdfmetrics.registerFont(TTFont(FONT_HANDWRITING_JPN, jpn_handwriting_font_path))
+jpeg_quality = DEFAULT_JPEG_QUALITY
+
+# How many images were embedded with each encoding, and their encoded size in bytes, since the last reset_image_stats
+image_stats = {}
+image_stats_lock = threading.Lock()
+
+# The images being prepared in the background, keyed by get_prefetch_key, as futures of prepare_image results
+prefetched_images = {}
+
+# The processed images drawn more than once in each document (keyed by the canvas), by get_image_key,
+# with None for the images drawn once so far
+document_image_sources = WeakKeyDictionary()
+
+
+def init(fonts_dir_path: str, frame_imgs_dir_path: str, font_cache_dir_path: str = None):
+    # Fonts are only registered when first used (see register_font), so fonts that are never needed are never parsed
+    global font_paths, font_cache_dir
+    font_cache_dir = font_cache_dir_path
+    font_paths = {
+        # English fonts
+        FONT_ENG: os.path.join(fonts_dir_path, "Roboto/Roboto-Regular.ttf"),
+        FONT_BOLD_ENG: os.path.join(fonts_dir_path, "Roboto/Roboto-Bold.ttf"),
+        FONT_HANDWRITING_ENG: os.path.join(fonts_dir_path, "PlaywriteGBS/PlaywriteGBS-Regular.ttf"),
+        # Japanese fonts
+        FONT_JPN: os.path.join(fonts_dir_path, "NotoSansJP/NotoSansJP-Regular.ttf"),
+        FONT_BOLD_JPN: os.path.join(fonts_dir_path, "NotoSansJP/NotoSansJP-Bold.ttf"),
+        FONT_HANDWRITING_JPN: os.path.join(fonts_dir_path, "HachiMaruPop/HachiMaruPop-Regular.ttf")
+    }
 
     global frame_top_left_path, frame_top_path, frame_top_right_path
     global frame_left_path, frame_centre_path, frame_right_path
@@ -94,40 +161,125 @@ def init(fonts_dir_path: str, frame_imgs_dir_path: str):
     frame_centre_path = os.path.join(frame_imgs_dir_path, "frame-centre.png")
     
 
+# Returns the paths of the files that are shared by all headers (fonts and frame images)
+def get_shared_file_paths() -> list:
+    frame_paths = [
+        frame_top_left_path, frame_top_path, frame_top_right_path,
+        frame_left_path, frame_centre_path, frame_right_path,
+        frame_bottom_left_path, frame_bottom_path, frame_bottom_right_path]
+    return list(font_paths.values()) + frame_paths
+
+
+def register_font(font_name: str):
+    if font_name in registered_font_names:
+        return
+    with timing.time_stage(timing.STAGE_FONT_REGISTRATION):
+        font = load_font(font_name, font_paths[font_name], font_cache_dir)
+        pdfmetrics.registerFont(font)
+        registered_font_names.add(font_name)
+
+
+def set_asset_cache(cache: AssetCache):
+    global asset_cache
+    asset_cache = cache
+
+
+# Set to 0 to keep every image lossless
+def set_jpeg_quality(quality: int):
+    global jpeg_quality
+    jpeg_quality = quality
+
+
 # https://stackoverflow.com/questions/30069846/how-to-find-out-chinese-or-japanese-character-in-a-string-in-python
+# The result is cached per text, as the same names are checked many times while measuring and writing them
+@lru_cache(maxsize=None)
 def text_contains_asian_chars(text: str) -> bool:
   if not text:
       return False
   
   for char in text:
-    is_asian_char = any([range["from"] <= ord(char) <= range["to"] for range in ASIAN_CHAR_RANGES])
-    if is_asian_char:
+    if is_asian_char(ord(char)):
       return True
     
   return False
 
 
+# Binary search of the code point in the sorted table of Asian character ranges
+def is_asian_char(code_point: int) -> bool:
+    range_index = bisect_right(ASIAN_CHAR_RANGE_STARTS, code_point) - 1
+    return range_index >= 0 and code_point <= ASIAN_CHAR_RANGE_ENDS[range_index]
+
+
 def get_text_width(text: str, font_weight: str = FONT_WEIGHT_REGULAR, font_size: float = DEFAULT_TEXT_SIZE) -> float:
-    font_name = get_font_name(text, font_weight)
-    text_width = stringWidth(text, font_name, font_size)
+    # Same formula used by stringWidth, so the result is exactly the same as measuring at the given size
+    text_width = 0.001*font_size*get_text_units_width(text, font_weight)
     return text_width
 
 
+# Text width scales linearly with the font size, so each text is only measured once, in font units (i.e. at size 1000)
+@lru_cache(maxsize=None)
+def get_text_units_width(text: str, font_weight: str) -> float:
+    font_name = get_font_name(text, font_weight)
+    return stringWidth(text, font_name, 1000)
+
+
+# Returns the biggest font size, going down from max_font_size in steps of font_size_step, at which all the rows fit within max_width
+# The size is worked out directly from the measured width, instead of measuring the rows again at every step
+def get_fitting_font_size(rows: list, max_width: float, font_weight: str = FONT_WEIGHT_REGULAR, max_font_size: float = DEFAULT_TEXT_SIZE, font_size_step: float = 1) -> float:
+    steps = 0
+    for row in rows:
+        units_width = get_text_units_width(row, font_weight)
+        if units_width <= 0:
+            continue
+        row_steps = max(steps, math.ceil((max_font_size - 1000*max_width/units_width) / font_size_step))
+        # Correct any floating point rounding, so the result matches checking each step
+        while 0.001*(max_font_size - row_steps*font_size_step)*units_width > max_width:
+            row_steps += 1
+        while row_steps > steps and 0.001*(max_font_size - (row_steps-1)*font_size_step)*units_width <= max_width:
+            row_steps -= 1
+        steps = row_steps
+    return max_font_size - steps*font_size_step
+
+
+@lru_cache(maxsize=None)
 def get_font_name(text: str, font_weight: str) -> str:
-    if text_contains_asian_chars(text):
-        if font_weight == FONT_WEIGHT_BOLD:
-            return FONT_BOLD_JPN
-        elif font_weight == FONT_WEIGHT_HANDWRITING:
-            return FONT_HANDWRITING_JPN
-        else:
-            return FONT_JPN
+    eng_font_name = ENG_FONT_NAMES.get(font_weight, FONT_ENG)
+    if font_selection == FONT_SELECTION_COVERAGE:
+        use_jpn_font = not does_font_cover_text(eng_font_name, text)
     else:
-        if font_weight == FONT_WEIGHT_BOLD:
-            return FONT_BOLD_ENG
-        elif font_weight == FONT_WEIGHT_HANDWRITING:
-            return FONT_HANDWRITING_ENG
-        else:
-            return FONT_ENG
+        use_jpn_font = text_contains_asian_chars(text)
+
+    font_name = eng_font_name
+    if use_jpn_font:
+        font_name = JPN_FONT_NAMES.get(font_weight, FONT_JPN)
+
+    register_font(font_name)
+    return font_name
+
+
+# Chooses how get_font_name picks between the English and Japanese fonts:
+# by checking the text against the Asian character ranges, or by checking whether the English font has a glyph for every character
+# The text caches are kept when the selection doesn't change, e.g. between the jobs of a batch
+def set_font_selection(selection: str):
+    global font_selection
+    if selection == font_selection:
+        return
+    font_selection = selection
+    get_font_name.cache_clear()
+    get_text_units_width.cache_clear()
+
+
+def does_font_cover_text(font_name: str, text: str) -> bool:
+    font_code_points = get_font_code_points(font_name)
+    return all([ord(char) in font_code_points for char in text])
+
+
+# The code points mapped to a glyph by the font's cmap
+@lru_cache(maxsize=None)
+def get_font_code_points(font_name: str) -> frozenset:
+    register_font(font_name)
+    font = pdfmetrics.getFont(font_name)
+    return frozenset(font.face.charToGlyph)
 
 
 def write_text(text: str, x: float, y: float, canvas: Canvas, font_weight: str = FONT_WEIGHT_REGULAR, font_size: float = DEFAULT_TEXT_SIZE, h_align: str = H_ALIGN_LEFT, v_align: str = V_ALIGN_BOTTOM):
@@ -139,39 +291,112 @@ def write_text(text: str, x: float, y: float, canvas: Canvas, font_weight: str =
 
     font_name = get_font_name(text, font_weight)
     canvas.setFont(font_name, font_size)
-    text_width = stringWidth(text, font_name, font_size)
+    text_width = get_text_width(text, font_weight, font_size)
 
-    # drawString takes the coordinates of the bottom-left of the text,
-    # so we only need to adjust for centre/right and middle/top
+    # drawString takes the coordinates of the bottom-left of the text
+    x, y = get_aligned_origin(x, y, text_width, font_size, h_align, v_align)
+
+    canvas.drawString(x, y, text)
+
+
+# Returns the bottom-left corner of a box of the given size, aligned on (x, y)
+# e.g. a box aligned to the right and top has (x, y) as its top-right corner
+def get_aligned_origin(x: float, y: float, width: float, height: float, h_align: str, v_align: str) -> tuple:
     if h_align == H_ALIGN_CENTRE:
-        x = x - (text_width / 2)
+        x = x - (width / 2)
     elif h_align == H_ALIGN_RIGHT:
-        x = x - text_width
+        x = x - width
     if v_align == V_ALIGN_MIDDLE:
-        y = y - (font_size / 2)
+        y = y - (height / 2)
     elif v_align == V_ALIGN_TOP:
-        y = y - font_size
-
-    canvas.drawString(x, y, text)
+        y = y - height
+    return x, y
 
 
 def draw_image(
         image_path: str, x: float, y: float, canvas: Canvas, width: float = None, height: float = None,
         h_align: str = H_ALIGN_LEFT, v_align: str = V_ALIGN_BOTTOM, crop_to_cover: bool = False,
-        colour_placeholder = None, colour_new = None, border_width: float = 0):
-    image = Image.open(image_path)
-    if (crop_to_cover):
-        image = crop_image_to_cover(image, width, height)
+        colour_placeholder = None, colour_new = None, border_width: float = 0, dpi: float = None):
+    image = None
+    opened_image = None
+    image_source = None
+    prefetched_image = None
+    if colour_placeholder and colour_new:
+        image = get_recoloured_image(image_path, colour_placeholder, colour_new)
+        image_w, image_h, transform = get_image_placement(image.size, width, height, crop_to_cover, dpi)
+    else:
+        prefetched_image = prefetched_images.pop(get_prefetch_key(image_path, width, height, crop_to_cover, dpi), None)
 
-    image_w, image_h = image.size
-    image_ratio = image_w / image_h
+    if prefetched_image:
+        # Already opened and processed in the background
+        image_w, image_h, transform, image_source = prefetched_image.result()
+    elif not image:
+        opened_image = Image.open(image_path)
+        image = opened_image
+        image_w, image_h, transform = get_image_placement(image.size, width, height, crop_to_cover, dpi)
+
+    # drawImage takes the coordinates of the bottom-left of the image
+    x, y = get_aligned_origin(x, y, image_w, image_h, h_align, v_align)
 
     if colour_placeholder and colour_new:
-        for i in range(0, image_w):
-            for j in range(0, image_h):
-                current_pixel_colour = image.getpixel((i, j))
-                if (current_pixel_colour == colour_placeholder):
-                    image.putpixel((i, j), colour_new)
+        # Recoloured images are only drawn within the frame forms, which are already reused, so they are drawn directly
+        box_ratio, pixel_size, _ = transform
+        image = process_image(image, pixel_size, box_ratio)
+        canvas.drawImage(get_image_io(image), x, y, width=image_w, height=image_h, mask='auto')
+    else:
+        # reportlab embeds each distinct image once per document, and every header drawing it again just references it
+        # The processed source of an image drawn again (e.g. a region symbol) is then kept, so it isn't processed for its next headers,
+        # while the images only drawn once (e.g. the covers) don't keep their pixels in memory until the document is saved
+        image_sources = document_image_sources.setdefault(canvas, {})
+        image_key = get_image_key(image_path, transform)
+        is_drawn_again = image_key in image_sources
+        if image_sources.get(image_key):
+            image_source = image_sources[image_key]
+        elif not image_source:
+            image_source = get_image_source(image_path, image, transform, is_embedded=not is_drawn_again)
+        image_sources[image_key] = image_source if is_drawn_again else None
+        with timing.time_stage(timing.STAGE_IMAGE_EMBEDDING):
+            canvas.drawImage(image_source, x, y, width=image_w, height=image_h, mask='auto')
+
+    # Release the file and the pixels of the image now that it's embedded, rather than whenever it's garbage collected
+    if opened_image:
+        opened_image.close()
+
+    if border_width > 0:
+        canvas.setLineWidth(border_width)
+        canvas.setStrokeColorRGB(0, 0, 0)
+        canvas.rect(x, y, image_w, image_h, stroke=1, fill=0)
+
+    return image_w, image_h
+
+
+def draw_frame(x: float, y: float, canvas: Canvas, width: float = 400, height: float = 150, border_thickness: float= 10, h_align: str = H_ALIGN_LEFT, v_align: str = V_ALIGN_BOTTOM, is_full_size: bool = False):
+    x, y, width, height = get_frame_placement(x, y, width, height, border_thickness, h_align, v_align, is_full_size)
+    full_w = width + 2*border_thickness
+    full_h = height + 2*border_thickness
+
+    # Frames with the same size look exactly the same, so each one is drawn only once as a form and then reused
+    frame_form_name = get_frame_form_name(width, height, border_thickness)
+    if not canvas.hasForm(frame_form_name):
+        with timing.time_stage(timing.STAGE_FRAME_DRAWING):
+            canvas.beginForm(frame_form_name, lowerx=0, lowery=0, upperx=full_w, uppery=full_h)
+            draw_frame_parts(0, 0, canvas, width, height, border_thickness)
+            canvas.endForm()
+
+    canvas.saveState()
+    canvas.translate(x, y)
+    canvas.doForm(frame_form_name)
+    canvas.restoreState()
+
+
+# Returns the size of the image on the page and the transform (box ratio, pixel size, DPI) to apply to its pixels
+# Only the size of the source image is needed, so this is worked out before decoding it, as it may be decoded at a reduced size
+def get_image_placement(source_size: tuple, width: float, height: float, crop_to_cover: bool, dpi: float) -> tuple:
+    image_w, image_h = source_size
+    if crop_to_cover:
+        image_ratio = width / height
+    else:
+        image_ratio = image_w / image_h
 
     if width:
         image_w = width
@@ -183,48 +408,59 @@ def draw_image(
     elif width:
         image_h = width / image_ratio
 
-    # drawImage takes the coordinates of the bottom-left of the text,
-    # so we only need to adjust for centre/right and middle/top
-    if h_align == H_ALIGN_CENTRE:
-        x = x - (image_w / 2)
-    elif h_align == H_ALIGN_RIGHT:
-        x = x - image_w
-    if v_align == V_ALIGN_MIDDLE:
-        y = y - (image_h / 2)
-    elif v_align == V_ALIGN_TOP:
-        y = y - image_h
+    # Only keep as many pixels as can be printed at the given DPI
+    pixel_size = None
+    if dpi:
+        pixel_size = get_pixel_size(image_w, image_h, dpi)
+    box_ratio = None
+    if crop_to_cover:
+        box_ratio = image_ratio
 
-    image_io = get_image_io(image)
-    canvas.drawImage(image_io, x, y, width=image_w, height=image_h, mask='auto')
+    return image_w, image_h, (box_ratio, pixel_size, dpi)
 
-    if border_width > 0:
-        canvas.setLineWidth(border_width)
-        canvas.setStrokeColorRGB(0, 0, 0)
-        canvas.rect(x, y, image_w, image_h, stroke=1, fill=0)
 
-    return image_w, image_h
+# Opens and processes the image as draw_image would, so it can be done ahead of time (e.g. by the ImagePrefetcher)
+# Returns the size of the image on the page, the transform applied to it and the processed image source
+def prepare_image(image_path: str, width: float = None, height: float = None, crop_to_cover: bool = False, dpi: float = None) -> tuple:
+    with Image.open(image_path) as image:
+        image_w, image_h, transform = get_image_placement(image.size, width, height, crop_to_cover, dpi)
+        image_source = get_image_source(image_path, image, transform)
+    return image_w, image_h, transform, image_source
 
 
-def draw_frame(x: float, y: float, canvas: Canvas, width: float = 400, height: float = 150, border_thickness: float= 10, h_align: str = H_ALIGN_LEFT, v_align: str = V_ALIGN_BOTTOM, is_full_size: bool = False):
+def get_prefetch_key(image_path: str, width: float, height: float, crop_to_cover: bool, dpi: float) -> tuple:
+    return (image_path, width, height, crop_to_cover, dpi)
+
+
+def get_image_key(image_path: str, transform: tuple) -> tuple:
+    return (get_file_hash(image_path), transform)
+
+
+def get_frame_form_name(width: float, height: float, border_thickness: float) -> str:
+    return f"Frame_{width!r}_{height!r}_{border_thickness!r}"
+
+
+# Returns the bottom-left corner of the frame and the size within its borders
+# The alignment takes the full width/height of the frame into account, borders included
+def get_frame_placement(x: float, y: float, width: float, height: float, border_thickness: float, h_align: str, v_align: str, is_full_size: bool) -> tuple:
     if (is_full_size):
         width = width - 2*border_thickness
         height = height - 2*border_thickness
 
     full_w = width + 2*border_thickness
     full_h = height + 2*border_thickness
+    x, y = get_aligned_origin(x, y, full_w, full_h, h_align, v_align)
+    return x, y, width, height
 
-    # drawImage takes the coordinates of the bottom-left of the text,
-    # so we only need to adjust for centre/right and middle/top
-    #  We still need to adjust this as we want to take into consideration the full width/height of the frame
-    if h_align == H_ALIGN_CENTRE:
-        x = x - (full_w / 2)
-    elif h_align == H_ALIGN_RIGHT:
-        x = x - full_w
-    if v_align == V_ALIGN_MIDDLE:
-        y = y - (full_h / 2)
-    elif v_align == V_ALIGN_TOP:
-        y = y - full_h
 
+def draw_frame_parts(x: float, y: float, canvas: Canvas, width: float, height: float, border_thickness: float):
+    for image_path, part_x, part_y, part_w, part_h in get_frame_parts(x, y, width, height, border_thickness):
+        draw_frame_image(image_path, part_x, part_y, canvas, width=part_w, height=part_h)
+
+
+# Returns the path, bottom-left corner and size of each of the images the frame is made of, in drawing order
+# The parts overlap slightly, so that no gap shows between them
+def get_frame_parts(x: float, y: float, width: float, height: float, border_thickness: float) -> list:
     centre_width = width + 2*FRAME_PARTS_GAP
     left_x = x
     centre_x = left_x + border_thickness - FRAME_PARTS_GAP
@@ -235,35 +471,268 @@ def draw_frame(x: float, y: float, canvas: Canvas, width: float = 400, height: f
     middle_y = bottom_y + border_thickness - FRAME_PARTS_GAP
     top_y = middle_y + middle_height - FRAME_PARTS_GAP
 
-    draw_frame_image(frame_top_left_path, left_x, top_y, canvas, width=border_thickness, height=border_thickness)
-    draw_frame_image(frame_top_path, centre_x, top_y, canvas, width=centre_width, height=border_thickness)
-    draw_frame_image(frame_top_right_path, right_x, top_y, canvas, width=border_thickness, height=border_thickness)
-    draw_frame_image(frame_left_path, left_x, middle_y, canvas, width=border_thickness, height=middle_height)
-    draw_frame_image(frame_bottom_left_path, left_x, bottom_y, canvas, width=border_thickness, height=border_thickness)
-    draw_frame_image(frame_bottom_path, centre_x, bottom_y, canvas, width=centre_width, height=border_thickness)
-    draw_frame_image(frame_bottom_right_path, right_x, bottom_y, canvas, width=border_thickness, height=border_thickness)
-    draw_frame_image(frame_right_path, right_x, middle_y, canvas, width=border_thickness, height=middle_height)
-    draw_frame_image(frame_centre_path, centre_x, middle_y, canvas, width=centre_width, height=middle_height)
+    return [
+        (frame_top_left_path, left_x, top_y, border_thickness, border_thickness),
+        (frame_top_path, centre_x, top_y, centre_width, border_thickness),
+        (frame_top_right_path, right_x, top_y, border_thickness, border_thickness),
+        (frame_left_path, left_x, middle_y, border_thickness, middle_height),
+        (frame_bottom_left_path, left_x, bottom_y, border_thickness, border_thickness),
+        (frame_bottom_path, centre_x, bottom_y, centre_width, border_thickness),
+        (frame_bottom_right_path, right_x, bottom_y, border_thickness, border_thickness),
+        (frame_right_path, right_x, middle_y, border_thickness, middle_height),
+        (frame_centre_path, centre_x, middle_y, centre_width, middle_height)
+    ]
 
 
 def draw_frame_image(image_path, x, y, canvas, width, height):
     draw_image(image_path, x, y, canvas, width=width, height=height, colour_placeholder=FRAME_BG_COLOUR_PLACEHOLDER, colour_new=FRAME_BG_COLOUR)
 
 
-def get_image_io(image: Image) -> ImageReader:
+# The recoloured images never change during a run, so they are only computed once per path and colour pair
+# The returned image is shared, so it must not be modified by the caller
+@lru_cache(maxsize=None)
+def get_recoloured_image(image_path: str, colour_placeholder: tuple, colour_new: tuple) -> Image:
+    image = Image.open(image_path)
+    return recolour_image(image, colour_placeholder, colour_new)
+
+
+def recolour_image(image: Image, colour_placeholder: tuple, colour_new: tuple) -> Image:
+    bands = image.split()
+    # A pixel can only match the placeholder if it has the same number of channels
+    if len(bands) != len(colour_placeholder):
+        return image
+
+    # Build a mask of the pixels matching the placeholder on every channel
+    mask = None
+    for band, placeholder_value in zip(bands, colour_placeholder):
+        band_lut = [255 if value == placeholder_value else 0 for value in range(256)]
+        band_mask = band.point(band_lut)
+        mask = band_mask if mask is None else ImageChops.multiply(mask, band_mask)
+
+    recoloured_image = image.copy()
+    recoloured_image.paste(colour_new, mask=mask)
+    return recoloured_image
+
+
+# Returns the processed image, ready to be drawn, from the assets cache when possible
+# It's only counted in the image stats when it's embedded, i.e. not when it's processed again for an image already in the document
+def get_image_source(image_path: str, image: Image, transform: tuple, is_embedded: bool = True):
+    box_ratio, pixel_size, _ = transform
+    image_encoding = get_image_encoding(image_path, image, pixel_size, box_ratio)
+
+    # The JPEG data is embedded in the PDF as it is, without decoding it
+    if image_encoding == IMAGE_ENCODING_JPEG_AS_IS:
+        add_image_stats(is_embedded, image_encoding, os.path.getsize(image_path))
+        return image_path
+
+    image_format = ASSET_CACHE_FORMAT_PNG
+    save_params = {}
+    if image_encoding == IMAGE_ENCODING_JPEG:
+        image_format = ASSET_CACHE_FORMAT_JPEG
+        save_params = {"quality": jpeg_quality}
+
+    if asset_cache is None:
+        image = process_image(image, pixel_size, box_ratio)
+        with timing.time_stage(timing.STAGE_IMAGE_ENCODING):
+            if image_encoding == IMAGE_ENCODING_JPEG:
+                image_data = get_jpeg_data(image, save_params)
+            else:
+                image_data = get_png_data(image)
+        add_image_stats(is_embedded, image_encoding, image_data.getbuffer().nbytes)
+        return ImageReader(image_data)
+
+    cache_key = asset_cache.get_key(image_path, transform, image_format, save_params)
+    image_source = asset_cache.get(cache_key, image_format)
+    if not image_source:
+        image = process_image(image, pixel_size, box_ratio)
+        if image_encoding == IMAGE_ENCODING_JPEG:
+            image = get_jpeg_compatible_image(image)
+        with timing.time_stage(timing.STAGE_IMAGE_ENCODING):
+            image_source = asset_cache.put(cache_key, image, image_format, save_params)
+    add_image_stats(is_embedded, image_encoding, os.path.getsize(image_source))
+    return image_source
+
+
+# JPEG images left as they are by the processing are embedded as is, while photographic images (JPEG images and covers)
+# are encoded as JPEG, which is much smaller than the lossless data of a photo
+# Images with transparency (e.g. symbols) and the other images are kept lossless
+def get_image_encoding(image_path: str, image: Image, pixel_size: tuple, box_ratio: float) -> str:
+    is_photographic = image.format == "JPEG" or box_ratio
+    # Some covers have an alpha channel that is fully opaque, so it's only checked for photographic images
+    if has_alpha(image) and not (is_photographic and is_image_opaque(image_path, image)):
+        return IMAGE_ENCODING_LOSSLESS
+    if image.format == "JPEG" and image.mode in ["RGB", "L"] and is_image_unchanged(image.size, pixel_size, box_ratio):
+        return IMAGE_ENCODING_JPEG_AS_IS
+    if jpeg_quality > 0 and is_photographic:
+        return IMAGE_ENCODING_JPEG
+    return IMAGE_ENCODING_LOSSLESS
+
+
+def has_alpha(image: Image) -> bool:
+    return image.mode in ["RGBA", "LA", "PA", "RGBa", "La"] or "transparency" in image.info
+
+
+# Checking the alpha channel decodes the whole image, so the result is kept in the assets cache for the next runs
+def is_image_opaque(image_path: str, image: Image) -> bool:
+    if asset_cache is None:
+        return is_opaque(image)
+    image_is_opaque = asset_cache.get_opacity(image_path)
+    if image_is_opaque is None:
+        image_is_opaque = is_opaque(image)
+        asset_cache.put_opacity(image_path, image_is_opaque)
+    return image_is_opaque
+
+
+def is_opaque(image: Image) -> bool:
+    if image.mode not in ["RGBA", "LA"]:
+        image = image.convert("RGBA")
+    min_alpha, _ = image.getchannel("A").getextrema()
+    return min_alpha == 255
+
+
+# Whether process_image would leave the pixels of the image as they are
+def is_image_unchanged(image_size: tuple, pixel_size: tuple = None, box_ratio: float = None) -> bool:
+    image_w, image_h = image_size
+    if box_ratio and get_cover_crop_box(image_size, box_ratio) != (0, 0, image_w, image_h):
+        return False
+    return not pixel_size or image_w <= pixel_size[0] or image_h <= pixel_size[1]
+
+
+def get_jpeg_compatible_image(image: Image) -> Image:
+    if image.mode not in ["RGB", "L"]:
+        image = image.convert("RGB")
+    return image
+
+
+def get_jpeg_data(image: Image, save_params: dict) -> io.BytesIO:
+    image_data = io.BytesIO()
+    get_jpeg_compatible_image(image).save(image_data, format="jpeg", **save_params)
+    image_data.seek(0)
+    return image_data
+
+
+def get_png_data(image: Image) -> io.BytesIO:
     image_data = io.BytesIO()
-    image.save(image_data, format='png')
+    image.save(image_data, format="png")
     image_data.seek(0)
-    image_io = ImageReader(image_data)
-    return image_io
+    return image_data
+
+
+def add_image_stats(is_embedded: bool, image_encoding: str, encoded_size: int):
+    if not is_embedded:
+        return
+    with image_stats_lock:
+        count, total_encoded_size = image_stats.get(image_encoding, (0, 0))
+        image_stats[image_encoding] = (count + 1, total_encoded_size + encoded_size)
+
+
+# Returns the image stats collected since the last reset, and starts collecting them again
+def reset_image_stats() -> dict:
+    global image_stats
+    with image_stats_lock:
+        collected_image_stats = image_stats
+        image_stats = {}
+    return collected_image_stats
+
+
+# Adds up the image stats of multiple renders (e.g. from the worker processes)
+def merge_image_stats(image_stats_list: list) -> dict:
+    merged_image_stats = {}
+    for stats in image_stats_list:
+        for image_encoding, (count, encoded_size) in stats.items():
+            merged_count, merged_encoded_size = merged_image_stats.get(image_encoding, (0, 0))
+            merged_image_stats[image_encoding] = (merged_count + count, merged_encoded_size + encoded_size)
+    return merged_image_stats
+
+
+# Logs how the images were embedded, and how big the PDF is
+def log_image_report(image_stats: dict, output_file_path: str):
+    if image_stats:
+        log("Embedded images:")
+        if IMAGE_ENCODING_JPEG_AS_IS in image_stats:
+            count, encoded_size = image_stats[IMAGE_ENCODING_JPEG_AS_IS]
+            log(f"{count} JPEG as is, {encoded_size / (1024*1024):.1f} MB", 1)
+        if IMAGE_ENCODING_JPEG in image_stats:
+            count, encoded_size = image_stats[IMAGE_ENCODING_JPEG]
+            log(f"{count} JPEG at quality {jpeg_quality}, {encoded_size / (1024*1024):.1f} MB", 1)
+        if IMAGE_ENCODING_LOSSLESS in image_stats:
+            count, encoded_size = image_stats[IMAGE_ENCODING_LOSSLESS]
+            log(f"{count} lossless, {encoded_size / (1024*1024):.1f} MB", 1)
+    log(f"PDF size: {os.path.getsize(output_file_path) / (1024*1024):.1f} MB")
+
+
+# Crops the image to the box ratio, if specified, and shrinks it to the given pixel size, if specified
+def process_image(image: Image, pixel_size: tuple = None, box_ratio: float = None) -> Image:
+    with timing.time_stage(timing.STAGE_IMAGE_PROCESSING):
+        if pixel_size:
+            reduce_image_decoding(image, pixel_size[0], pixel_size[1], box_ratio)
+
+        if box_ratio:
+            image = crop_image_to_cover(image, box_ratio, 1)
+
+        if pixel_size:
+            image = downsample_image(image, pixel_size[0], pixel_size[1])
+
+    return image
+
+
+# reportlab reads the pixels straight from the image, so there's no need to encode it first
+def get_image_io(image: Image) -> ImageReader:
+    # The source file may be closed before the image is drawn
+    image.load()
+    return ImageReader(image)
+
+
+def get_image_dpi(config: dict) -> float:
+    if config.get("draft", False):
+        return config.get("draft_dpi", DEFAULT_DRAFT_DPI)
+    return config.get("print_dpi", DEFAULT_PRINT_DPI)
+
+
+# Converts a size in points into the number of pixels needed to print it at the given DPI
+def get_pixel_size(width: float, height: float, dpi: float) -> tuple:
+    pixel_w = max(1, math.ceil(width / inch * dpi))
+    pixel_h = max(1, math.ceil(height / inch * dpi))
+    return pixel_w, pixel_h
+
+
+# Asks the decoder to load the image at a reduced scale, if the format allows it (e.g. JPEG)
+# The decoded image is still at least as big as needed for the given pixel size, after cropping to the box ratio if specified
+def reduce_image_decoding(image: Image, pixel_w: int, pixel_h: int, box_ratio: float = None):
+    image_w, image_h = image.size
+    region_w, region_h = image_w, image_h
+    if box_ratio:
+        region_w = min(image_w, image_h * box_ratio)
+        region_h = min(image_h, image_w / box_ratio)
+
+    scale = max(pixel_w / region_w, pixel_h / region_h)
+    if scale < 1:
+        image.draft(image.mode, (math.ceil(image_w * scale), math.ceil(image_h * scale)))
+
+
+# Shrinks the image to the given pixel size, but never enlarges it
+def downsample_image(image: Image, pixel_w: int, pixel_h: int) -> Image:
+    image_w, image_h = image.size
+    if image_w <= pixel_w or image_h <= pixel_h:
+        return image
+
+    if image.mode in ["1", "P"]:
+        image = image.convert("RGBA")
+    return image.resize((pixel_w, pixel_h), Image.LANCZOS)
 
 
 def crop_image_to_cover(image: Image, width: float, height: float) -> Image:
+    # Crop the image
+    cropped_image = image.crop(get_cover_crop_box(image.size, width / height))
+    return cropped_image
+
+
+# Returns the centred (left, top, right, bottom) box of the image with the given aspect ratio
+def get_cover_crop_box(image_size: tuple, box_ratio: float) -> tuple:
     # Determine the aspect ratios of the image and the page
-    image_width, image_height = image.size
+    image_width, image_height = image_size
 
     image_ratio = image_width / image_height
-    box_ratio = width / height
 
     if image_ratio > box_ratio:
         # The image is too wide, crop horizontally
@@ -278,9 +747,16 @@ def crop_image_to_cover(image: Image, width: float, height: float) -> Image:
         bottom = top + new_image_height
         left, right = 0, image_width
 
-    # Crop the image
-    cropped_image = image.crop((left, top, right, bottom))
-    return cropped_image
+    return (left, top, right, bottom)
+
+
+# Concatenates the pages of the given PDFs, in order, into a single PDF
+# Each PDF is written to the output as soon as it's read, so merging many PDFs doesn't take more memory than the biggest of them
+def merge_pdfs(input_file_paths: list, output_file_path: str):
+    with timing.time_stage(timing.STAGE_PDF_MERGE):
+        with PdfStreamWriter(output_file_path) as pdf_writer:
+            for input_file_path in input_file_paths:
+                pdf_writer.append(input_file_path)
 
 
 def parse_json(file_path: str) -> dict:
@@ -290,41 +766,68 @@ def parse_json(file_path: str) -> dict:
     return parsed
 
 
+# Yields the items of the JSON array in the file one at a time, reading the file a block at a time,
+# so that only the current item is held in memory instead of the whole parsed file
+def iter_json_array(file_path: str, block_size: int = JSON_READ_BLOCK_SIZE) -> Iterator:
+    decoder = json.JSONDecoder()
+    with open(file_path, encoding='utf-8') as f:
+        # The buffer is only trimmed to what's left to decode when more of the file is read, and pos is where decoding resumes
+        buffer = ""
+        pos = 0
+        is_eof = False
+        is_array_open = False
+        while True:
+            pos = JSON_WHITESPACE_PATTERN.match(buffer, pos).end()
+            if pos < len(buffer):
+                if not is_array_open:
+                    if buffer[pos] != "[":
+                        raise ValueError(f"{file_path} doesn't contain a JSON array")
+                    is_array_open = True
+                    pos += 1
+                    continue
+                if buffer[pos] == "]":
+                    return
+                if buffer[pos] == ",":
+                    pos += 1
+                    continue
+
+                try:
+                    item, item_end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    item_end = None
+                # Items must be followed by a separator, as a number split across blocks would still decode (e.g. "2" of "2.5")
+                if item_end is not None:
+                    separator_pos = JSON_WHITESPACE_PATTERN.match(buffer, item_end).end()
+                    if is_eof or (separator_pos < len(buffer) and buffer[separator_pos] in ",]"):
+                        yield item
+                        pos = item_end
+                        continue
+
+            if is_eof:
+                if pos < len(buffer):
+                    raise ValueError(f"Invalid JSON array item in {file_path}")
+                raise ValueError(f"Unexpected end of the JSON array in {file_path}")
+
+            # The item is split across blocks, so more of the file is read before it's decoded again from its start
+            # At least as much as what's left in the buffer is read, so the buffer doubles and a large item is only decoded a few times
+            buffer = buffer[pos:]
+            pos = 0
+            block = f.read(max(block_size, len(buffer)))
+            is_eof = not block
+            buffer += block
+
+
+# Raised with the reason a config value is invalid, so that a single job or request can be reported and skipped
+class ConfigError(Exception):
+    pass
+
+
 def parse_yaml(file_path: str) -> dict:
     with open(file_path, "r") as f:
         parsed = yaml.safe_load(f)
     return parsed
 
 
-def is_set_included(serie_id: str, set_id: str, filters: dict) -> bool:
-    is_included = False
-
-    for included_serie_set in filters["included_sets"]:
-        included_parts = included_serie_set.split("/")
-        if len(included_parts) != 2:
-            continue
-        included_serie = included_parts[0]
-        included_set = included_parts[1]
-        if included_serie in ["*", serie_id] and included_set in ["*", set_id]:
-            is_included = True
-            break
-    
-    if not is_included:
-        return False
-    
-    for excluded_serie_set in filters["excluded_sets"]:
-        excluded_parts = excluded_serie_set.split("/")
-        if len(excluded_parts) != 2:
-            continue
-        excluded_serie = excluded_parts[0]
-        excluded_set = excluded_parts[1]
-        if excluded_serie in ["*", serie_id] and excluded_set in ["*", set_id]:
-            is_included = False
-            break
-    
-    return is_included
-
-
 def log(text: str, indent_level: int = 0):
     log_text = ""
     for x in range(0, indent_level):
@@ -0,0 +1,106 @@
+import os
+import copy
+import time
+
+import scripts.utils as u
+from scripts.set_filter import SetFilter, FilterError
+from scripts.catalog import CatalogError, load_catalog, get_snapshot_dir_path
+from scripts.batch import get_generator
+
+# How often, in seconds, the watched files are checked for changes
+WATCH_POLL_INTERVAL = 0.5
+
+# How many of the changed files are listed before each build
+MAX_LOGGED_CHANGED_PATHS = 5
+
+
+# Generates the PDF again whenever the catalog, the config or any watched file changes, until interrupted
+# The builds are incremental, so only the pages whose headers changed are rendered again,
+# while the fonts, the measured texts and the assets manifest stay loaded between builds
+# Every build still plans all the headers and merges all the pages again, and the processed images aren't kept in memory,
+# they are read back from the assets cache (or processed again when it's disabled)
+# Files are polled rather than watched through the OS, so that it works the same everywhere without any extra dependency
+def watch(data, catalog_file_path: str, config_file_path: str, watched_paths: list):
+    all_watched_paths = [catalog_file_path, config_file_path] + watched_paths
+    snapshot = get_files_snapshot(all_watched_paths)
+    build(data, catalog_file_path, config_file_path)
+    u.log("\nWatching for changes, press Ctrl+C to stop")
+
+    try:
+        while True:
+            time.sleep(WATCH_POLL_INTERVAL)
+            new_snapshot = get_files_snapshot(all_watched_paths)
+            changed_paths = get_changed_paths(snapshot, new_snapshot)
+            if not changed_paths:
+                continue
+            snapshot = new_snapshot
+
+            changed_paths_text = ", ".join([os.path.relpath(path) for path in changed_paths[:MAX_LOGGED_CHANGED_PATHS]])
+            if len(changed_paths) > MAX_LOGGED_CHANGED_PATHS:
+                changed_paths_text += f" and {len(changed_paths) - MAX_LOGGED_CHANGED_PATHS} more"
+            u.log(f"\nChanged: {changed_paths_text}")
+            build(data, catalog_file_path, config_file_path)
+            u.log("\nWatching for changes, press Ctrl+C to stop")
+    except KeyboardInterrupt:
+        pass
+
+
+# Parses the catalog and the config again and builds the PDF incrementally
+# Errors (e.g. a catalog saved halfway through an edit) are logged, and the next change is waited for
+def build(data, catalog_file_path: str, config_file_path: str):
+    start_time = time.perf_counter()
+    try:
+        config = u.parse_yaml(config_file_path)
+        catalog = load_catalog(catalog_file_path, get_snapshot_dir_path(config, data.cache_dir_path))
+        generator = get_generator(config)
+
+        u.set_font_selection(config.get("font_selection", u.FONT_SELECTION_RANGES))
+        u.set_jpeg_quality(config.get("jpeg_quality", u.DEFAULT_JPEG_QUALITY))
+
+        build_data = copy.copy(data)
+        build_data.config = dict(config, incremental=True)
+        build_data.catalog = SetFilter(config["filters"]).select(catalog)
+        generator.generate(build_data)
+        data.asset_manifest.save()
+    except u.ConfigError as error:
+        u.log(f"{error}. Waiting for changes.")
+        return
+    except CatalogError as error:
+        u.log(f"Invalid catalog: {error}. Waiting for changes.")
+        return
+    except FilterError as error:
+        u.log(f"Invalid filter {error}. Waiting for changes.")
+        return
+    except Exception as error:
+        u.log(f"Build failed: {error!r}. Waiting for changes.")
+        return
+    u.log(f"Built in {time.perf_counter() - start_time:.2f} s")
+
+
+# The modification time and size of every file in the given files and folders
+def get_files_snapshot(paths: list) -> dict:
+    snapshot = {}
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, _, file_names in os.walk(path):
+                for file_name in file_names:
+                    add_file_to_snapshot(snapshot, os.path.join(dir_path, file_name))
+        else:
+            add_file_to_snapshot(snapshot, path)
+    return snapshot
+
+
+def add_file_to_snapshot(snapshot: dict, file_path: str):
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        # Missing, or deleted while scanning
+        return
+    snapshot[file_path] = (stat.st_mtime_ns, stat.st_size)
+
+
+# The files added, modified or deleted between the two snapshots, in order
+def get_changed_paths(snapshot: dict, new_snapshot: dict) -> list:
+    changed_paths = [path for path, file_state in new_snapshot.items() if snapshot.get(path) != file_state]
+    changed_paths += [path for path in snapshot if path not in new_snapshot]
+    return sorted(changed_paths)